@@ -4,7 +4,7 @@ from functools import wraps
 from json import dumps as _encode_json, loads as decode_json
 from queue import Queue
 from re import compile as regex
-from time import sleep
+from urllib.parse import urlencode
 from urllib.request import (
     Request,
     urlopen,
@@ -26,6 +26,8 @@ def generate_task_id(f):
     return wrapper
 
 class PoudomaticClient:
+    RESULT_WAIT = 25
+
     _HEADERS = {
         "Content-Type": "application/json",
     }
@@ -72,9 +74,10 @@ class PoudomaticClient:
                 raise
         return results
 
-    def _follow_log_request(self, task_id, endpoint, queue):
+    def _follow_log_request(self, task_id, endpoint, queue, params):
+        query = urlencode(params)
         req = Request(
-            f"{endpoint}/log/{task_id}",
+            f"{endpoint}/log/{task_id}{'?' if query else ''}{query}",
             headers=self._SSE_HEADERS,
         )
         with urlopen(req, timeout=30) as resp:
@@ -111,12 +114,23 @@ class PoudomaticClient:
 
             queue.put((endpoint, None))
 
-    def follow_log(self, task_id):
+    def follow_log(self, task_id, origin=None, tail=None, after=None,
+                   events=False):
+        params = {
+            key: value
+            for key,value in (
+                ("origin", origin),
+                ("tail", tail),
+                ("after", after),
+                ("events", "true" if events else None),
+            )
+            if value is not None
+        }
         queue = Queue()
         futures = [
             self.pool.submit(
                 self._follow_log_request,
-                task_id, endpoint, queue
+                task_id, endpoint, queue, params
             )
             for endpoint in self.endpoints
         ]
@@ -127,18 +141,44 @@ class PoudomaticClient:
 
     def get_result(self, task_id):
         def run(endpoint):
+            req = Request(
+                f"{endpoint}/result/{task_id}?wait={self.RESULT_WAIT}",
+                headers=self._HEADERS,
+            )
             while True:
-                req = Request(
-                    f"{endpoint}/result/{task_id}",
-                    headers=self._HEADERS,
-                )
-                with urlopen(req, timeout=5) as resp:
+                with urlopen(req, timeout=self.RESULT_WAIT + 5) as resp:
                     status,res = decode_json(resp.fp.read())
                     if status == 3:
                         return res
-                    sleep(2.5)
         return self._request_run(run)
 
+    def search(self, query, task_id=None, origin=None, limit=None):
+        params = {
+            key: value
+            for key,value in (
+                ("q", query),
+                ("task", task_id),
+                ("origin", origin),
+                ("limit", limit),
+            )
+            if value is not None
+        }
+        return self.req("GET", f"search?{urlencode(params)}")
+
+    def build_times(self, origins=(), jail=None, ports_branch=None,
+                    percentiles=None):
+        params = [
+            (key, value)
+            for key,value in (
+                *(("origin", origin) for origin in origins),
+                ("jail", jail),
+                ("branch", ports_branch),
+                *(("percentile", p) for p in percentiles or ()),
+            )
+            if value is not None
+        ]
+        return self.req("GET", f"buildtimes?{urlencode(params)}")
+
     def info(self):
         portsbranches = set()
         jails = set()
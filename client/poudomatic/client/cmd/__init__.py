@@ -5,9 +5,11 @@ from sys import base_prefix
 
 from .. import PoudomaticClient
 from .build import build,buildlog
+from .buildtimes import buildtimes
 from .depends import depends
 from .info import info
 from .ports import ports
+from .search import search
 
 def configure(ctx, param, filenames):
     filenames = [Path(filenames)] if filenames is not None else [
@@ -56,8 +58,10 @@ def main(ctx, endpoint):
 # main.add_command(depends)
 main.add_command(build)
 main.add_command(buildlog)
+main.add_command(buildtimes)
 main.add_command(info)
 main.add_command(ports)
+main.add_command(search)
 
 __all__ = (
     "main",
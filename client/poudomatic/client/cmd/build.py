@@ -1,22 +1,34 @@
 from click import command, option, argument, echo
 from click.decorators import pass_meta_key
 
+tail_option = option(
+    "--tail", type=int, metavar="N",
+    help="Only show the last N log entries before following.",
+)
+since_option = option(
+    "--since", type=int, metavar="ID",
+    help="Only show log entries after entry ID.",
+)
+
 @command()
 @option("--nowait", is_flag=True, help="...")
 @option("--repo", multiple=True)
+@tail_option
+@since_option
 @argument("jail_version")
 @argument("ports_branch")
 @argument("origins", nargs=-1)
 @pass_meta_key("client")
-def build(client, jail_version, ports_branch, origins, repo, nowait):
+def build(client, jail_version, ports_branch, origins, repo, nowait,
+          tail, since):
     task_id = client.build(jail_version, ports_branch, origins, repo)
 
     if nowait:
         click.echo(task_id)
         return
 
-    for endpoint,msg in client.follow_log(task_id):
-        if msg.get("origin") is None:
+    for endpoint,msg in client.follow_log(task_id, tail=tail, after=since):
+        if msg.get("origin") is None and msg.get("type") != "event":
             echo(msg["msg"])
 
     origins = set()
@@ -33,11 +45,29 @@ def build(client, jail_version, ports_branch, origins, repo, nowait):
         for origin in sorted(origins):
             echo(f"  poudomatic buildlog {task_id} {origin}")
 
+def format_event(msg):
+    fields = " ".join(
+        f"{key}={value}" for key,value in msg.items()
+        if key not in ("type", "event") and value is not None
+    )
+    return f"{msg['event']}: {fields}"
+
 @command()
+@tail_option
+@since_option
+@option("--events", is_flag=True,
+        help="Only show progress events instead of log lines.")
 @argument("task_id")
 @argument("origin", required=False)
 @pass_meta_key("client")
-def buildlog(client, task_id, origin):
-    for endpoint,msg in client.follow_log(task_id):
-        if msg.get("origin") == origin:
+def buildlog(client, task_id, origin, tail, since, events):
+    if events:
+        for endpoint,msg in client.follow_log(task_id, tail=tail,
+                                              after=since, events=True):
+            if origin is None or msg.get("port") == origin:
+                echo(format_event(msg))
+        return
+
+    for endpoint,msg in client.follow_log(task_id, origin, tail, since):
+        if msg.get("origin") == origin and msg.get("type") != "event":
             echo(msg["msg"])
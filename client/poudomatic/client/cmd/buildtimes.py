@@ -0,0 +1,25 @@
+from click import command, option, argument, echo
+from click.decorators import pass_meta_key
+
+def format_duration(seconds):
+    minutes,seconds = divmod(round(seconds), 60)
+    hours,minutes = divmod(minutes, 60)
+    return f"{hours:02}:{minutes:02}:{seconds:02}"
+
+@command()
+@option("--jail", "jail_version", help="Prefer builds on this jail.")
+@option("--branch", "ports_branch", help="Prefer builds of this ports branch.")
+@option("--percentile", type=float, multiple=True,
+        help="Percentiles to show, 50 and 90 by default.")
+@argument("origins", nargs=-1)
+@pass_meta_key("client")
+def buildtimes(client, origins, jail_version, ports_branch, percentile):
+    for endpoint,results in client.build_times(
+            origins, jail_version, ports_branch, percentile).items():
+        for origin,stats in sorted(results.items()):
+            times = " ".join(
+                f"{key}={format_duration(value)}"
+                for key,value in stats.items()
+                if key not in ("pkgbase", "builds")
+            )
+            echo(f"{origin} builds={stats['builds']} {times}")
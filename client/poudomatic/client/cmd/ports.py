@@ -13,7 +13,8 @@ def update(client, ports_branch, nowait):
         return
 
     for endpoint,msg in client.follow_log(task_id):
-        echo(msg["msg"])
+        if msg.get("type") == "log":
+            echo(msg["msg"])
 
 
 @group()
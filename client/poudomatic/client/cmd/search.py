@@ -0,0 +1,14 @@
+from click import command, option, argument, echo
+from click.decorators import pass_meta_key
+
+@command()
+@option("--task", "task_id", help="Only search the log of this task.")
+@option("--origin", help="Only search log entries of this origin.")
+@option("--limit", type=int, help="Maximum number of lines per endpoint.")
+@argument("query")
+@pass_meta_key("client")
+def search(client, query, task_id, origin, limit):
+    for endpoint,results in client.search(query, task_id, origin, limit).items():
+        for item in results:
+            origin = item["origin"] or "-"
+            echo(f"{item['task']} {origin}: {item['msg']}")
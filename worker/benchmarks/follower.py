@@ -0,0 +1,111 @@
+import argparse
+import json
+import sys
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from threading import Thread
+from time import perf_counter, sleep
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from poudomatic.worker.util.follow import open_follower
+
+from storage import summarize
+
+def builder(path, files, lines, rate, line_size):
+    # each builder compiles its share of ports one after another
+    padding = "x" * max(0, line_size - 40)
+    for name in files:
+        with open(path / name, "w", buffering=1) as fp:
+            for i in range(lines):
+                fp.write(f"{perf_counter():.9f} {i} {padding}\n")
+                if rate:
+                    sleep(1 / rate)
+            fp.write("build time: 00:00:01\n")
+
+def bench_follow(backend, builders, files, lines, rate, line_size, tmpdir):
+    with TemporaryDirectory(dir=tmpdir) as path:
+        path = Path(path)
+        follow = open_follower(path, backend)
+        names = [ f"port-{i}.log" for i in range(files) ]
+        threads = [
+            Thread(target=builder, args=(
+                path, names[i::builders], lines, rate, line_size
+            ))
+            for i in range(builders)
+        ]
+
+        def run():
+            for thread in threads:
+                thread.join()
+            follow.close()
+
+        latencies = []
+        received = 0
+        batches = 0
+        start = perf_counter()
+        for thread in threads:
+            thread.start()
+        Thread(target=run).start()
+
+        for filename,batch in follow.batches():
+            now = perf_counter()
+            batches += 1
+            for line in batch:
+                if line.startswith(b"build time:"):
+                    follow.remove(filename)
+                    continue
+                received += 1
+                if received % 100 == 0:
+                    latencies.append(now - float(line.split(b" ", 1)[0]))
+        elapsed = perf_counter() - start
+
+        return {
+            "received": received,
+            "expected": files * lines,
+            "batches": batches,
+            "seconds": elapsed,
+            "lines_per_second": received / elapsed,
+            "latency": summarize(latencies),
+        }
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark following build logs."
+    )
+    parser.add_argument("--backend", nargs="+", default=["auto"])
+    parser.add_argument("--builders", type=int, nargs="+", default=[1, 6])
+    parser.add_argument("--files", type=int, default=60)
+    parser.add_argument("--lines", type=int, default=5_000, help=(
+        "Lines written to every log file."
+    ))
+    parser.add_argument("--rate", type=float, default=0, help=(
+        "Lines per second written by every builder; 0 writes as fast "
+        "as possible."
+    ))
+    parser.add_argument("--line-size", type=int, default=120)
+    parser.add_argument("--tmpdir", default=None, help=(
+        "Directory for the temporary log directories."
+    ))
+    args = parser.parse_args()
+
+    for backend in args.backend:
+        for builders in args.builders:
+            params = {
+                "builders": builders,
+                "files": args.files,
+                "lines": args.lines,
+                "rate": args.rate,
+                "line_size": args.line_size,
+            }
+            result = bench_follow(backend, tmpdir=args.tmpdir, **params)
+            print(json.dumps({
+                "benchmark": "follow",
+                "backend": backend,
+                "params": params,
+                "result": result,
+            }), flush=True)
+
+if __name__ == "__main__":
+    sys.exit(main() or 0)
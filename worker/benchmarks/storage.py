@@ -0,0 +1,239 @@
+import anyio
+import argparse
+import json
+import sys
+
+from pathlib import Path
+from statistics import quantiles
+from tempfile import TemporaryDirectory
+from threading import Thread
+from time import perf_counter, sleep
+from uuid import uuid4
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from poudomatic.worker.storage import Storage
+
+def db_size(stor):
+    stor._sql("PRAGMA wal_checkpoint(TRUNCATE)")
+    path = Path(stor._path)
+    return sum(
+        p.stat().st_size
+        for p in (path, Path(f"{path}-wal"))
+        if p.exists()
+    )
+
+def summarize(values):
+    values = sorted(values)
+    if len(values) < 2:
+        values = values * 2
+    pct = quantiles(values, n=100, method="inclusive")
+    return {
+        "count": len(values),
+        "p50": pct[49],
+        "p90": pct[89],
+        "p99": pct[98],
+        "max": values[-1],
+    }
+
+def log_entry(i, origin=None):
+    return {
+        "type": "log",
+        "msg": f"===> Building for foo-1.0_{i}: cc -O2 -pipe -c foo.c -o foo.o",
+        "origin": origin,
+    }
+
+def start_task(stor, tid):
+    # only claimed tasks can be ended
+    stor.enqueue(tid, {})
+    stor.claim_next(
+        lambda pending, running: next(t for t,_ in pending if t == tid)
+    )
+
+def bench_add_log(open_storage, lines, writers):
+    with open_storage() as stor:
+        tids = [uuid4().hex for _ in range(writers)]
+        for tid in tids:
+            start_task(stor, tid)
+
+        def write(tid):
+            for i in range(lines):
+                stor.add_log(tid, log_entry(i, "devel/foo"))
+
+        threads = [Thread(target=write, args=(tid,)) for tid in tids]
+        start = perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for tid in tids:
+            stor.end_task(tid)
+        elapsed = perf_counter() - start
+
+        return {
+            "lines": lines * writers,
+            "seconds": elapsed,
+            "lines_per_second": lines * writers / elapsed,
+        }
+
+def bench_watch_log(open_storage, lines, subscribers, rate):
+    with open_storage() as stor:
+        tid = uuid4().hex
+        start_task(stor, tid)
+        latencies = []
+
+        def write():
+            for i in range(lines):
+                stor.add_log(tid, { **log_entry(i), "t": perf_counter() })
+                if rate:
+                    sleep(1 / rate)
+            stor.end_task(tid)
+
+        async def running():
+            return True
+
+        async def subscribe():
+            async for _,data in stor.watch_log(tid, running):
+                latencies.append(perf_counter() - json.loads(data)["t"])
+
+        async def main():
+            async with anyio.create_task_group() as tg:
+                for _ in range(subscribers):
+                    tg.start_soon(subscribe)
+                await anyio.sleep(0.1)
+                await anyio.to_thread.run_sync(write)
+
+        anyio.run(main)
+
+        return {
+            "received": len(latencies),
+            "latency": summarize(latencies),
+        }
+
+def bench_claim(open_storage, depth, claims):
+    with open_storage() as stor:
+        for _ in range(depth):
+            stor.enqueue(uuid4().hex, {})
+
+        latencies = []
+        for _ in range(min(claims, depth)):
+            start = perf_counter()
+            stor.start_next_task()
+            latencies.append(perf_counter() - start)
+
+        return {
+            "latency": summarize(latencies),
+        }
+
+def bench_read_under_load(open_storage, lines, readers, reads):
+    with open_storage() as stor:
+        tids = [uuid4().hex for _ in range(readers)]
+        for tid in tids:
+            stor.enqueue(tid, {})
+            for i in range(1_000):
+                stor.add_log(tid, log_entry(i, "devel/foo"))
+        writing = uuid4().hex
+        start_task(stor, writing)
+        latencies = []
+
+        def write():
+            for i in range(lines):
+                stor.add_log(writing, log_entry(i, "devel/foo"))
+            stor.end_task(writing)
+
+        def read(tid):
+            for _ in range(reads):
+                start = perf_counter()
+                stor.get_result(tid)
+                stor._get_log_sync(tid, 0, "devel/foo", 100)
+                latencies.append(perf_counter() - start)
+
+        writer = Thread(target=write)
+        threads = [Thread(target=read, args=(tid,)) for tid in tids]
+        writer.start()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        writer.join()
+
+        return {
+            "latency": summarize(latencies),
+            "stats": stor.stats(),
+        }
+
+def bench_growth(open_storage, lines):
+    with open_storage() as stor:
+        before = db_size(stor)
+        tid = uuid4().hex
+        start_task(stor, tid)
+        for i in range(lines):
+            stor.add_log(tid, log_entry(i, "devel/foo"))
+        stor.end_task(tid)
+        grown = db_size(stor) - before
+
+        return {
+            "lines": lines,
+            "bytes": grown,
+            "bytes_per_million_lines": grown * 1_000_000 / lines,
+        }
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the task database of poudomatic-worker."
+    )
+    parser.add_argument("--lines", type=int, default=100_000)
+    parser.add_argument("--watch-lines", type=int, default=2_000)
+    parser.add_argument("--watch-rate", type=float, default=1_000, help=(
+        "Log lines per second written while measuring watch_log; "
+        "0 writes as fast as possible."
+    ))
+    parser.add_argument("--queue-depth", type=int, nargs="+",
+                        default=[100, 1_000, 10_000])
+    parser.add_argument("--claims", type=int, default=100)
+    parser.add_argument("--reads", type=int, default=200, help=(
+        "Queries per reader while measuring read_under_load."
+    ))
+    parser.add_argument("--notifier", default="auto")
+    parser.add_argument("--tmpdir", default=None, help=(
+        "Directory for the temporary databases."
+    ))
+    args = parser.parse_args()
+
+    with TemporaryDirectory(dir=args.tmpdir) as tmpdir:
+        def open_storage():
+            return Storage(
+                Path(tmpdir) / f"{uuid4().hex}.sqlite",
+                notifier=args.notifier,
+            )
+
+        def run(name, func, **params):
+            result = func(open_storage, **params)
+            print(json.dumps({
+                "benchmark": name,
+                "notifier": args.notifier,
+                "params": params,
+                "result": result,
+            }), flush=True)
+
+        for writers in (1, 2):
+            run("add_log", bench_add_log,
+                lines=args.lines // writers, writers=writers)
+
+        for subscribers in (1, 10, 100):
+            run("watch_log", bench_watch_log,
+                lines=args.watch_lines, subscribers=subscribers,
+                rate=args.watch_rate)
+
+        for depth in args.queue_depth:
+            run("start_next_task", bench_claim,
+                depth=depth, claims=args.claims)
+
+        for readers in (1, 4, 16):
+            run("read_under_load", bench_read_under_load,
+                lines=args.lines, readers=readers, reads=args.reads)
+
+        run("growth", bench_growth, lines=args.lines)
+
+if __name__ == "__main__":
+    sys.exit(main() or 0)
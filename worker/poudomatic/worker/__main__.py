@@ -1,9 +1,26 @@
 import argparse
 import logging
 import sys
-import time
 
 from .environment import Environment
+from .scheduler import Scheduler
+from .storage import Heartbeat,Retention
+
+RETENTION_OPTIONS = (
+    ( "interval",      float ),
+    ( "archive_after", float ),
+    ( "max_age",       float ),
+    ( "max_size",      int   ),
+    ( "vacuum_pages",  int   ),
+    ( "build_history", int   ),
+)
+
+def get_retention_config(env):
+    config = {}
+    for key,conv in RETENTION_OPTIONS:
+        if (value := env.get_config("retention", key, default=None)) is not None:
+            config[key] = conv(value)
+    return config
 
 def main():
     try:
@@ -13,32 +30,35 @@ def main():
                 "ZFS dataset to use as Poudomatic's enviroment root."
             )
         )
+        parser.add_argument(
+            "-j", "--slots", metavar="N", type=int, default=None, help=(
+                "Number of tasks to run in parallel. Defaults to the "
+                "'slots' option in the 'worker' section of the "
+                "configuration or 1."
+            )
+        )
 
         logging.basicConfig(level=logging.DEBUG)
 
         args = parser.parse_args()
         env = Environment(args.dataset)
+        slots = args.slots or int(env.get_config("worker", "slots", default=1))
 
-        with env.storage as stor:
-            while True:
-                if task := stor.start_next_task():
-                    task_id,task = task
-                    logging.info(f"Starting task {task_id}.")
-                    try:
-                        res = {
-                            "status": "success",
-                            "detail": task.run(env, task_id),
-                        }
-                        logging.info(f"Task {task_id} completed successfully.")
-                    except KeyboardInterrupt:
-                        raise
-                    except Exception as e:
-                        logging.exception(f"Task {task_id} died with exception.")
-                        res = { "status": "error", "detail": str(e) }
-                    finally:
-                       stor.end_task(task_id, res)
-                else:
-                    stor.wait_for_changes()
+        with ( env.storage as stor,
+               Scheduler(env, stor, slots) as sched ):
+            heartbeat = Heartbeat(stor, sched.leased)
+            heartbeat.start()
+            retention = Retention(stor, **get_retention_config(env))
+            retention.start()
+            try:
+                while True:
+                    if not sched.start_next():
+                        # expired leases of other workers don't touch the
+                        # database, so look for them once in a while
+                        stor.wait_for_changes(stor.lease_time)
+            finally:
+                retention.stop()
+                heartbeat.stop()
 
     except KeyboardInterrupt:
         return
@@ -0,0 +1,205 @@
+import os
+import sys
+
+from abc import ABC, abstractmethod
+from array import array
+from collections import namedtuple
+from itertools import chain
+from pathlib import Path
+from types import MappingProxyType
+
+PkgDeps = namedtuple("PkgDeps", (
+    "pkgmap",
+    "depends",
+))
+
+BulkStats = namedtuple("BulkStats", (
+    "built",
+    "queued",
+))
+
+class Symbols:
+    def __init__(self):
+        self.names = []
+        self.ids = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def intern(self, name):
+        if (id := self.ids.get(name)) is None:
+            id = self.ids[name] = len(self.names)
+            self.names.append(sys.intern(name))
+        return id
+
+class MetaFile(ABC):
+    def __init__(self, path):
+        self.path = Path(path)
+        self.generation = 0
+        self._reset()
+
+    def _reset(self):
+        self._ident = None
+        self._offset = 0
+        self._mtime = None
+        self._partial = b""
+        self.generation += 1
+        self.clear()
+
+    def clear(self):
+        pass
+
+    @abstractmethod
+    def parse(self, fields):
+        pass
+
+    def refresh(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            if self._ident is not None:
+                self._reset()
+            return
+
+        ident = (st.st_dev, st.st_ino)
+        if st.st_size == self._offset:
+            if ident == self._ident and st.st_mtime_ns == self._mtime:
+                return
+            # rewritten in place to the same size
+            self._reset()
+        elif ident != self._ident or st.st_size < self._offset:
+            self._reset()
+        self._ident = ident
+
+        # poudriere only appends to these, so read what's new
+        with self.path.open("rb") as fp:
+            fp.seek(self._offset)
+            data = fp.read()
+        self._offset += len(data)
+        self._mtime = st.st_mtime_ns
+
+        *lines,self._partial = (self._partial + data).split(b"\n")
+        for line in lines:
+            if fields := line.decode().split():
+                self.parse(fields)
+
+class AllPkgs(MetaFile):
+    def __init__(self, path, symbols):
+        self.symbols = symbols
+        super().__init__(path)
+
+    def clear(self):
+        self.pkgmap = {}
+        # origin id by package id, -1 for symbols that aren't packages
+        self.origins = array("l")
+
+    def parse(self, fields):
+        pkg,origin,*_ = fields
+        pkg_id = self.symbols.intern(pkg)
+        origin_id = self.symbols.intern(origin)
+        if len(self.origins) < len(self.symbols):
+            self.origins.extend([-1] * (len(self.symbols) - len(self.origins)))
+        self.origins[pkg_id] = origin_id
+        self.pkgmap[self.symbols.names[pkg_id]] = self.symbols.names[origin_id]
+
+class PkgDepsFile(MetaFile):
+    def __init__(self, path, symbols):
+        self.symbols = symbols
+        super().__init__(path)
+
+    def clear(self):
+        # edges as parallel arrays of package ids
+        self.pkgs = array("l")
+        self.deps = array("l")
+
+    def parse(self, fields):
+        pkg,dep = fields
+        self.pkgs.append(self.symbols.intern(pkg))
+        self.deps.append(self.symbols.intern(dep))
+
+class PortsBuilt(MetaFile):
+    def clear(self):
+        self.built = set()
+
+    def parse(self, fields):
+        _,pkg,*_ = fields
+        self.built.add(sys.intern(pkg))
+
+class PortsQueued(MetaFile):
+    def clear(self):
+        # package name by origin
+        self.queued = {}
+
+    def parse(self, fields):
+        origin,pkg,*_ = fields
+        self.queued[sys.intern(origin)] = sys.intern(pkg)
+
+class BulkMeta:
+    def __init__(self, base):
+        base = Path(base)
+        self.symbols = Symbols()
+        self.all_pkgs = AllPkgs(base / ".poudriere.all_pkgs%", self.symbols)
+        self.pkg_deps = PkgDepsFile(
+            base / ".poudriere.pkg_deps%", self.symbols
+        )
+        self.ports_built = PortsBuilt(base / ".poudriere.ports.built")
+        self.ports_queued = PortsQueued(base / ".poudriere.ports.queued")
+        self._generations = None
+        self._resolved = 0
+        self._unresolved = []
+        self._deps = {}
+        self._depends = {}
+
+    def read_pkg_deps(self):
+        self.all_pkgs.refresh()
+        self.pkg_deps.refresh()
+
+        generations = (self.all_pkgs.generation, self.pkg_deps.generation)
+        if generations != self._generations:
+            self._generations = generations
+            self._resolved = 0
+            self._unresolved = []
+            self._deps = {}
+            self._depends = {}
+
+        # only edges appended since the last call are resolved, plus those
+        # whose packages all_pkgs didn't list yet
+        names = self.symbols.names
+        origins = self.all_pkgs.origins
+        pkgs = self.pkg_deps.pkgs
+        deps = self.pkg_deps.deps
+        unresolved = []
+        changed = set()
+        for i in chain(self._unresolved, range(self._resolved, len(pkgs))):
+            pkg = origins[pkgs[i]] if pkgs[i] < len(origins) else -1
+            dep = origins[deps[i]] if deps[i] < len(origins) else -1
+            if pkg < 0 or dep < 0:
+                unresolved.append(i)
+                continue
+            self._deps.setdefault(names[pkg], set()).add(names[dep])
+            changed.add(names[pkg])
+        self._unresolved = unresolved
+        self._resolved = len(pkgs)
+
+        # callers get read-only views; only changed entries are copied
+        for origin in changed:
+            self._depends[origin] = frozenset(self._deps[origin])
+        return PkgDeps(
+            MappingProxyType(self.all_pkgs.pkgmap),
+            MappingProxyType(self._depends),
+        )
+
+    def read_bulk_stats(self):
+        self.ports_built.refresh()
+        self.ports_queued.refresh()
+        return BulkStats(
+            frozenset(self.ports_built.built),
+            MappingProxyType(self.ports_queued.queued),
+        )
+
+__all__ = (
+    "BulkMeta",
+    "BulkStats",
+    "PkgDeps",
+    "Symbols",
+)
@@ -0,0 +1,180 @@
+from collections import deque
+
+class CycleError(Exception):
+    pass
+
+class DepGraph:
+    def __init__(self):
+        self.names = []
+        self.ids = {}
+        # dependencies and dependents of every node, by node id
+        self.deps = []
+        self.rdeps = []
+        self._topo = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, origin):
+        return origin in self.ids
+
+    def node(self, origin):
+        if (id := self.ids.get(origin)) is None:
+            id = self.ids[origin] = len(self.names)
+            self._topo = None
+            self.names.append(origin)
+            self.deps.append([])
+            self.rdeps.append([])
+        return id
+
+    def add_edges(self, edges):
+        # edges are (node, dependency) id pairs; dupes and loops are dropped
+        self._topo = None
+        seen = set()
+        for node,dep in edges:
+            if node == dep or (node, dep) in seen:
+                continue
+            seen.add((node, dep))
+            self.deps[node].append(dep)
+            self.rdeps[dep].append(node)
+
+    @classmethod
+    def from_depends(cls, depends):
+        graph = cls()
+        graph.add_edges(
+            (graph.node(origin), graph.node(dep))
+            for origin,deps in depends.items()
+            for dep in deps
+        )
+        return graph
+
+    @classmethod
+    def from_bulkmeta(cls, meta):
+        # works on the interned ids directly instead of the depends dict
+        meta.read_pkg_deps()
+        graph = cls()
+        names = meta.symbols.names
+        origins = meta.all_pkgs.origins
+        for origin_id in origins:
+            if origin_id >= 0:
+                graph.node(names[origin_id])
+
+        def node(pkg_id):
+            if pkg_id < len(origins) and origins[pkg_id] >= 0:
+                return graph.ids[names[origins[pkg_id]]]
+
+        graph.add_edges(
+            (a, b) for a,b in (
+                (node(pkg), node(dep))
+                for pkg,dep in zip(meta.pkg_deps.pkgs, meta.pkg_deps.deps)
+            )
+            if a is not None and b is not None
+        )
+        return graph
+
+    def _order(self):
+        # the graph doesn't change while a build is watched, but the order
+        # is asked for with every progress update
+        if self._topo is None:
+            self._topo = self._kahn()
+        return self._topo
+
+    def _kahn(self):
+        # dependencies come before their dependents
+        missing = [ len(deps) for deps in self.deps ]
+        queue = deque(id for id,count in enumerate(missing) if not count)
+        order = []
+        while queue:
+            id = queue.popleft()
+            order.append(id)
+            for rdep in self.rdeps[id]:
+                missing[rdep] -= 1
+                if not missing[rdep]:
+                    queue.append(rdep)
+        if len(order) != len(self.names):
+            raise CycleError(
+                "Dependency cycle involving " + ", ".join(
+                    sorted(self.names[id] for id,count in enumerate(missing)
+                           if count)
+                )
+            )
+        return order
+
+    def topological(self):
+        return [ self.names[id] for id in self._order() ]
+
+    def levels(self):
+        # ports on the same level don't depend on each other
+        level = [0] * len(self.names)
+        for id in self._order():
+            for rdep in self.rdeps[id]:
+                level[rdep] = max(level[rdep], level[id] + 1)
+        levels = [ [] for _ in range(max(level, default=-1) + 1) ]
+        for id,lvl in enumerate(level):
+            levels[lvl].append(self.names[id])
+        return levels
+
+    def critical_path(self, weights=None, default=1):
+        # the chain of dependencies taking longest to build one after the
+        # other; weights map origins to their expected build time
+        weight = [
+            default if weights is None else weights.get(name, default)
+            for name in self.names
+        ]
+        total = [0] * len(self.names)
+        prev = [None] * len(self.names)
+        for id in self._order():
+            best = None
+            for dep in self.deps[id]:
+                if best is None or total[dep] > total[best]:
+                    best = dep
+            prev[id] = best
+            total[id] = weight[id] + (0 if best is None else total[best])
+
+        if not total:
+            return (0, [])
+        id = max(range(len(total)), key=total.__getitem__)
+        length = total[id]
+        path = []
+        while id is not None:
+            path.append(self.names[id])
+            id = prev[id]
+        path.reverse()
+        return (length, path)
+
+    def _closure(self, origins, edges):
+        found = set()
+        queue = deque(self.ids[origin] for origin in origins
+                      if origin in self.ids)
+        found.update(queue)
+        while queue:
+            for other in edges[queue.popleft()]:
+                if other not in found:
+                    found.add(other)
+                    queue.append(other)
+        return found
+
+    def dependencies(self, *origins):
+        found = self._closure(origins, self.deps)
+        return { self.names[id] for id in found } - set(origins)
+
+    def dependents(self, *origins):
+        found = self._closure(origins, self.rdeps)
+        return { self.names[id] for id in found } - set(origins)
+
+    def rebuild_set(self, *changed):
+        # the changed ports and everything depending on them, in build order
+        found = self._closure(changed, self.rdeps)
+        return [ self.names[id] for id in self._order() if id in found ]
+
+    def to_depends(self):
+        return {
+            self.names[id]: sorted(self.names[dep] for dep in deps)
+            for id,deps in enumerate(self.deps)
+            if deps
+        }
+
+__all__ = (
+    "CycleError",
+    "DepGraph",
+)
@@ -4,7 +4,7 @@ from pathlib import Path
 
 from .poudriere import Poudriere
 from .storage import Storage
-from .util import zfs
+from .util import zfs,EventLoop,Runner
 from .versions import *
 
 MISSING = object()
@@ -60,7 +60,21 @@ class Environment:
             zfs.get_dataset(f"{dataset}/packages").mountpoint
         )
 
-        self._storage = Storage(self.db_path)
+        # child processes of all tasks share one thread, and so do the
+        # tasks' log followers
+        self.runner = Runner()
+        self.loop = EventLoop()
+        self._storage = Storage(
+            self.db_path,
+            notifier=self.get_config("storage", "notifier", default="auto"),
+            worker_id=self.get_config("worker", "id", default=None),
+            lease_time=float(
+                self.get_config("worker", "lease_time", default=60)
+            ),
+            read_connections=int(
+                self.get_config("storage", "read_connections", default=4)
+            ),
+        )
 
     def get_config(self, section, key, default=MISSING):
         conf = ConfigParser(
@@ -1,11 +1,12 @@
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Path, Body, Request, Header, HTTPException
-from json import dumps as encode_json
+from fastapi import FastAPI, Path, Body, Query, Request, Header, HTTPException
+from fastapi.responses import Response
 from pydantic import BaseSettings
 from sse_starlette.sse import EventSourceResponse, ServerSentEvent
-from typing import Annotated
+from typing import Annotated, Optional
 
 from .environment import Environment
+from .loghub import LogHub
 from .tasks import *
 
 class Settings(BaseSettings):
@@ -18,6 +19,7 @@ class Settings(BaseSettings):
 async def lifespan(app: FastAPI):
     app.env = Environment(settings.dataset, no_setup=True)
     with app.env.storage as app.store:
+        app.loghub = LogHub(app.store)
         yield
 
 settings = Settings()
@@ -32,22 +34,79 @@ def info(request: Request):
         "jails": list(request.app.env.list_jails()),
     }
 
+@app.get("/storage/stats")
+def storage_stats(request: Request):
+    return request.app.store.stats()
+
 @app.get("/log/{task_id}")
 async def log(request: Request,
               accept: Annotated[str, Header()],
-              task_id: str = TASK_ID_Path):
+              last_event_id: Annotated[Optional[int], Header()] = None,
+              task_id: str = TASK_ID_Path,
+              origin: Optional[str] = None,
+              after: int = Query(0, ge=0),
+              tail: Optional[int] = Query(None, ge=0),
+              limit: Optional[int] = Query(None, ge=1),
+              events: bool = False):
+    # reconnecting SSE clients continue where they left off
+    if last_event_id is not None:
+        after = max(after, last_event_id)
+
+    # structured progress events are only sent when asked for, and then
+    # without the log lines; older clients expect every entry to be text
+    kind = "event" if events else "log"
+
     if accept != "text/event-stream":
-        return await request.app.store.get_log(task_id)
+        # entries are stored as JSON already; no need to decode them
+        entries = await request.app.store.get_log(
+            task_id, after, origin, limit, tail, kind
+        )
+        return Response(
+            "[{}]".format(",".join(f"[{id},{data}]" for id,data in entries)),
+            media_type="application/json",
+        )
 
     async def is_connected():
         return not await request.is_disconnected()
 
     async def watch_log():
-        async for id,data in request.app.store.watch_log(task_id, is_connected):
-            yield ServerSentEvent(encode_json(data, ensure_ascii=False), id=id)
+        async for id,data in request.app.loghub.follow(
+                task_id, is_connected, origin, after, tail, kind):
+            yield ServerSentEvent(data, id=id)
 
     return EventSourceResponse(watch_log())
 
+@app.get("/search")
+async def search(request: Request,
+                 q: str = Query(min_length=1),
+                 task: Optional[str] = Query(None, regex="^[0-9a-f]{32}$"),
+                 origin: Optional[str] = None,
+                 limit: int = Query(100, ge=1, le=10000)):
+    return [
+        { "task": tid, "origin": origin, "id": id, "msg": msg }
+        for id,tid,origin,msg in await request.app.store.search(
+            q, task, origin, limit
+        )
+    ]
+
+@app.get("/buildtimes")
+def buildtimes(request: Request,
+               origin: Optional[list[str]] = Query(None),
+               jail: Optional[str] = None,
+               branch: Optional[str] = None,
+               percentile: list[float] = Query([50, 90]),
+               result: str = "success",
+               history: int = Query(20, ge=1, le=1000)):
+    if not all(0 <= p <= 100 for p in percentile):
+        raise HTTPException(
+            status_code=422, detail="Percentiles range from 0 to 100"
+        )
+    # with result=any failed builds count as well
+    return request.app.store.build_time_percentiles(
+        origin, jail, branch, percentile,
+        None if result == "any" else result, history
+    )
+
 @app.put("/depends/{task_id}")
 def depends(request: Request,
             task_id: str = TASK_ID_Path,
@@ -58,28 +117,42 @@ def depends(request: Request,
 @app.put("/build/{task_id}")
 def build(request: Request,
           task_id: str = TASK_ID_Path,
-          item: RunBuildTask = Body()):
-    request.app.store.enqueue(task_id, item)
+          item: RunBuildTask = Body(),
+          coalesce: bool = True):
+    request.app.store.enqueue(task_id, item, coalesce)
     return "ok"
 
 @app.put("/ports/update/{task_id}")
 def updateports(request: Request,
                 task_id: str = TASK_ID_Path,
-                item: UpdatePortsTask = Body()):
-    request.app.store.enqueue(task_id, item)
+                item: UpdatePortsTask = Body(),
+                coalesce: bool = True):
+    request.app.store.enqueue(task_id, item, coalesce)
     return "ok"
 
 @app.put("/jail/{task_id}")
 def jail(request: Request,
          task_id: str = TASK_ID_Path,
-         item: CreateJailTask = Body()):
-    request.app.store.enqueue(task_id, item)
+         item: CreateJailTask = Body(),
+         coalesce: bool = True):
+    request.app.store.enqueue(task_id, item, coalesce)
     return "ok"
 
+@app.get("/task/{task_id}/profile")
+def profile(request: Request, task_id: str = TASK_ID_Path):
+    # profiles are stored as JSON already; no need to decode them
+    if (res := request.app.store.get_profile(task_id)) is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if res[0] is None:
+        raise HTTPException(status_code=404, detail="No profile recorded")
+    return Response(res[0], media_type="application/json")
+
 @app.get("/result/{task_id}")
-def result(request: Request,
-           task_id: str = TASK_ID_Path):
-    if result := request.app.store.get_result(task_id):
+async def result(request: Request,
+                 task_id: str = TASK_ID_Path,
+                 wait: float = Query(0, ge=0, le=300)):
+    # with wait the request blocks until the task ends or time runs out
+    if result := await request.app.store.wait_result(task_id, wait):
         return result
     else:
         raise HTTPException(status_code=404, detail="Task not found")
@@ -0,0 +1,97 @@
+import anyio
+
+from collections import deque
+
+class LogChannel:
+    def __init__(self, store, key, size):
+        self.store = store
+        self.key = key
+        self.tid,self.origin,self.kind = key
+        self.entries = deque(maxlen=size)
+        self.floor = 0
+        self.maxid = 0
+        self.complete = False
+        self.primed = False
+        self.subscribers = 0
+        self._lock = anyio.Lock()
+
+    def buffered(self, start):
+        return [ (id,data) for id,data in self.entries if id > start ]
+
+    async def refresh(self, seen):
+        async with self._lock:
+            # another subscriber refreshed while we waited for the lock
+            if self.maxid > seen or self.complete:
+                return
+
+            # start buffering where the first subscriber wants to start
+            if not self.primed:
+                self.floor = self.maxid = seen
+
+            if self.primed:
+                await self.store.async_wait_for_changes()
+
+            complete,entries = await self.store._get_log(
+                self.tid, self.maxid, self.origin, kind=self.kind
+            )
+            self.primed = True
+
+            for entry in entries:
+                # everything newer than floor is still in the buffer
+                if len(self.entries) == self.entries.maxlen:
+                    self.floor = self.entries[0][0]
+                self.entries.append(entry)
+
+            if entries:
+                self.maxid = entries[-1][0]
+            self.complete = complete
+
+class LogHub:
+    def __init__(self, store, size=4096):
+        self.store = store
+        self.size = size
+        self._channels = {}
+
+    def _subscribe(self, key):
+        if (chan := self._channels.get(key)) is None:
+            chan = self._channels[key] = LogChannel(self.store, key, self.size)
+        chan.subscribers += 1
+        return chan
+
+    def _unsubscribe(self, chan):
+        chan.subscribers -= 1
+        if not chan.subscribers:
+            del self._channels[chan.key]
+
+    async def follow(self, tid, running=None, origin=None, start=0, tail=None,
+                     kind=None):
+        tid = await anyio.to_thread.run_sync(self.store._log_tid, tid)
+        pos = await self.store.log_start(tid, start, origin, tail, kind)
+        chan = self._subscribe((tid, origin, kind))
+        try:
+            while running is not None and await running():
+                if pos < chan.floor:
+                    # history older than the buffer comes from the database
+                    complete,entries = await self.store._get_log(
+                        tid, pos, origin, kind=kind
+                    )
+                elif pos < chan.maxid:
+                    complete,entries = False,chan.buffered(pos)
+                elif chan.complete:
+                    return
+                else:
+                    await chan.refresh(pos)
+                    continue
+
+                for id,data in entries:
+                    pos = id
+                    yield id,data
+
+                if complete:
+                    return
+        finally:
+            self._unsubscribe(chan)
+
+__all__ = (
+    "LogHub",
+)
@@ -1,4 +1,3 @@
-from collections import defaultdict,namedtuple
 from contextlib import contextmanager
 from os import walk as walk_dir
 from pathlib import Path
@@ -12,15 +11,8 @@ from .util import (
     CommandError,
 )
 from . import files
-
-PkgDeps = namedtuple("PkgDeps", (
-    "pkgmap",
-    "depends",
-))
-
-BulkStats = namedtuple("BulkStats", (
-    "built"
-))
+from .bulkmeta import BulkMeta
+from .depgraph import DepGraph
 
 class Poudriere:
     def __init__(self, dset, task_id):
@@ -29,6 +21,7 @@ class Poudriere:
         self.task_id = task_id
         self.path_basefs = Path(dset.mountpoint)
         self.path_logs = self.path_basefs / "logs"
+        self._bulkmeta = {}
 
     def __enter__(self):
         self.path           = TemporaryDirectory()
@@ -39,16 +32,26 @@ class Poudriere:
         self.path_make_conf = self.path_d / "make.conf"
 
         self.path_d.mkdir()
+        self.priority_boost = ()
+        self._write_conf()
+
+        self.cmd = ("/usr/local/bin/poudriere", "-e", self.path.name)
+        return self
+
+    def _write_conf(self):
         files.template_to_file(
             "poudriere.conf", self.path_conf,
-            ZPOOL   = self.zpool,
-            ZROOTFS = self.zrootfs,
-            BASEFS  = str(self.path_basefs),
-            TASK_ID = self.task_id,
+            ZPOOL          = self.zpool,
+            ZROOTFS        = self.zrootfs,
+            BASEFS         = str(self.path_basefs),
+            TASK_ID        = self.task_id,
+            PRIORITY_BOOST = " ".join(self.priority_boost),
         )
 
-        self.cmd = ("/usr/local/bin/poudriere", "-e", self.path.name)
-        return self
+    def set_priority_boost(self, pkgbases):
+        # poudriere starts these before anything else that is ready to build
+        self.priority_boost = tuple(pkgbases)
+        self._write_conf()
 
     def __exit__(self, ex_type, ex_value, ex_tb):
         self.path.cleanup()
@@ -65,7 +68,7 @@ class Poudriere:
                 (root / item).unlink()
 
     def __call__(self, *args):
-        return process(*self.cmd + args)
+        return process(*self.cmd + args, label=f"poudriere {args[0]}")
 
     def api(self, *stdin):
         return self("api") << stdin
@@ -101,7 +104,7 @@ class Poudriere:
         finally:
             self("jail", "-k", "-j", jailname, "-p", portstree).run()
 
-    def bulk(self, *args, logfunc=None):
+    def bulk(self, *args, logfunc=None, progress=None):
         errors = []
         try:
             with self("bulk", *args) as proc:
@@ -109,12 +112,23 @@ class Poudriere:
                     line = line.rstrip()
                     if logfunc:
                         logfunc(line)
+                    if progress is not None:
+                        progress.bulk_line(line)
                     _,_,msg = line.partition("Error: ")
                     if msg:
                         errors.append(msg)
         except CommandError:
             return errors
 
+    def start_bulk(self, runner, *args, logfunc=None, progress=None,
+                   on_exit=None):
+        def on_line(line):
+            if logfunc:
+                logfunc(line)
+            if progress is not None:
+                progress.bulk_line(line)
+        return runner.start(self("bulk", *args), on_line, on_exit)
+
     def get_logbase(self, jail, portsbranch):
         return (
             self.path_logs / "bulk" / f"{jail}-{portsbranch}" /
@@ -124,46 +138,29 @@ class Poudriere:
     def get_buildlogbase(self, jail, portsbranch):
         return self.get_logbase(jail, portsbranch) / "logs"
 
-    def read_pkg_deps(self , jail, portsbranch):
-        base = self.get_logbase(jail, portsbranch)
-        all_pkgs = base / ".poudriere.all_pkgs%"
-        pkg_deps = base / ".poudriere.pkg_deps%"
-
-        pkgmap = {}
-        depends = defaultdict(set)
-
-        if all_pkgs.exists() and pkg_deps.exists():
-            with all_pkgs.open() as fp:
-                for line in fp:
-                    pkg,origin,*_ = line.strip().split()
-                    pkgmap[pkg] = origin
+    def get_bulkmeta(self, jail, portsbranch):
+        # parsed metadata is cached and only appended lines get parsed
+        key = (jail, portsbranch)
+        if (meta := self._bulkmeta.get(key)) is None:
+            meta = self._bulkmeta[key] = BulkMeta(
+                self.get_logbase(jail, portsbranch)
+            )
+        return meta
 
-            with pkg_deps.open() as fp:
-                for line in fp:
-                    pkg,dep = line.strip().split()
-                    depends[pkgmap[pkg]].add(pkgmap[dep])
-
-        return PkgDeps(pkgmap, dict(depends))
+    def read_pkg_deps(self, jail, portsbranch):
+        return self.get_bulkmeta(jail, portsbranch).read_pkg_deps()
 
     def read_bulk_stats(self, jail, portsbranch):
-        base = self.get_logbase(jail, portsbranch)
-        ports_built = base / ".poudriere.ports.built"
-
-        built = set()
-
-        if ports_built.exists():
-            with ports_built.open() as fp:
-                for line in fp:
-                    _,pkg,*_ = line.strip().split()
-                    built.add(pkg)
+        return self.get_bulkmeta(jail, portsbranch).read_bulk_stats()
 
-        return BulkStats(built)
+    def read_depgraph(self, jail, portsbranch):
+        return DepGraph.from_bulkmeta(self.get_bulkmeta(jail, portsbranch))
 
 class PoudriereJail:
     def __init__(self, name):
         self.name = name
         self.path = Path(
-            process("jls", "-j", self.name, "path").run().strip()
+            process("jls", "-j", self.name, "path").run(full=True).strip()
         )
 
     def exec(self, *args):
@@ -0,0 +1,209 @@
+from re import compile as regex
+from threading import Lock
+from time import monotonic, time
+
+# [00:01:37] [01] [00:01:24] Finished ports-mgmt/pkg | pkg-1.19.1: Success
+RE_PORT = regex(
+    r"^\[[\d:]+\] \[(?P<builder>\d+)\] \[(?P<elapsed>[\d:]+)\] "
+    r"(?P<action>Building|Finished) (?P<origin>\S+)"
+    r"(?: \| (?P<pkg>[^:\s]+))?(?:: (?P<result>\w+))?"
+)
+# [00:00:13] Queued: 5 Built: 0 Failed: 0 Skipped: 0 Ignored: 0 ...
+RE_STATS = regex(r"(?P<key>Queued|Built|Failed|Skipped|Ignored|Fetched): "
+                 r"(?P<value>\d+)")
+# [00:00:12] Building 5 packages using up to 6 builders
+RE_BUILDERS = regex(r"Building (?P<queued>\d+) packages using "
+                    r"(?:up to )?(?P<builders>\d+) builders")
+# build time: 00:01:24
+RE_BUILD_TIME = regex(r"build time: (?P<time>\d+:\d{2}:\d{2})")
+
+COUNTERS = ("queued", "built", "failed", "skipped", "ignored")
+
+def parse_duration(value):
+    seconds = 0
+    for part in value.split(":"):
+        seconds = seconds * 60 + int(part)
+    return seconds
+
+class BulkProgress:
+    # walking the whole dependency graph takes a while on big builds
+    CRITICAL_INTERVAL = 10
+
+    def __init__(self, emit, estimates=None):
+        self._emit = emit
+        self._lock = Lock()
+        self._started = monotonic()
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        self.builders = None
+        self.busy = {}
+        self.durations = {}
+        self._durations_total = 0
+        self.done = set()
+        self.seen = set()
+        # expected build times by origin, from earlier builds
+        self.estimates = estimates or {}
+        self._estimates_mean = (
+            sum(self.estimates.values()) / len(self.estimates)
+            if self.estimates else None
+        )
+        self.started = {}
+        self.graph = None
+        self.queued = None
+        # queued ports not started yet; their estimates are kept summed up
+        self.waiting = None
+        self._waiting_known = 0
+        self._waiting_unknown = 0
+        self._critical = None
+
+    def _event(self, event, **fields):
+        self._emit({ "type": "event", "event": event, **fields })
+
+    def _mean(self):
+        if self.durations:
+            return self._durations_total / len(self.durations)
+        return self._estimates_mean
+
+    def _duration(self, origin, seconds):
+        self._durations_total += seconds - self.durations.get(origin, 0)
+        self.durations[origin] = seconds
+
+    def eta(self):
+        finished = sum(self.counts[key] for key in COUNTERS[1:])
+        remaining = max(0, self.counts["queued"] - finished)
+        if not remaining:
+            return 0
+        if (mean := self._mean()) is None:
+            return None
+
+        # ports being built take what's left of their expected time; no
+        # number of idle builders gets the longest port done sooner
+        now = monotonic()
+        weights = {
+            origin: max(0, self.estimates.get(origin, mean)
+                           - (now - self.started.get(origin, now)))
+            for origin in self.busy.values()
+        }
+        running = sum(weights.values())
+        if self.waiting is not None:
+            waiting = self._waiting_known + self._waiting_unknown * mean
+        else:
+            waiting = max(0, remaining - len(self.busy)) * mean
+
+        builders = self.builders or max(1, len(self.busy))
+        longest = max(weights.values(), default=0)
+        eta = max((running + waiting) / builders, longest)
+        if self.graph is not None:
+            # dependencies are built one after the other; in between two
+            # walks of the graph the chain just gets shorter
+            if (self._critical is None or
+                    now - self._critical[1] >= self.CRITICAL_INTERVAL):
+                for origin in self.waiting:
+                    weights[origin] = self.estimates.get(origin, mean)
+                length,_ = self.graph.critical_path(weights, default=0)
+                self._critical = (length, now)
+            length,at = self._critical
+            eta = max(eta, length - (now - at))
+        return round(eta)
+
+    def _progress(self):
+        eta = self.eta()
+        self._event(
+            "progress",
+            **self.counts,
+            builders=self.builders,
+            busy=len(self.busy),
+            elapsed=round(monotonic() - self._started),
+            eta=eta,
+            completion=None if eta is None else round(time() + eta),
+        )
+
+    def plan(self, graph, queued):
+        # queued are the origins poudriere is going to build
+        with self._lock:
+            self.graph = graph
+            self.queued = set(queued)
+            self.waiting = self.queued - self.seen
+            self._critical = None
+            for origin in self.waiting:
+                if (estimate := self.estimates.get(origin)) is None:
+                    self._waiting_unknown += 1
+                else:
+                    self._waiting_known += estimate
+            mean = self._mean()
+            length,path = graph.critical_path({
+                origin: self.estimates.get(origin, mean or 0)
+                for origin in self.queued
+            }, default=0)
+            self._event(
+                "plan",
+                ports=len(self.queued),
+                critical_path=path,
+                critical_time=round(length),
+            )
+            self._progress()
+
+    def _start(self, origin, builder=None):
+        # bulk output and the port's own log both report a start
+        if origin in self.seen:
+            return
+        self.seen.add(origin)
+        self.started[origin] = monotonic()
+        if self.waiting is not None and origin in self.waiting:
+            self.waiting.discard(origin)
+            if (estimate := self.estimates.get(origin)) is None:
+                self._waiting_unknown -= 1
+            else:
+                self._waiting_known -= estimate
+        self._event(
+            "start", port=origin, builder=builder,
+            expected=self.estimates.get(origin),
+        )
+
+    def bulk_line(self, line):
+        with self._lock:
+            if match := RE_PORT.match(line):
+                origin = match["origin"]
+                builder = int(match["builder"])
+                if match["action"] == "Building":
+                    self.busy[builder] = origin
+                    self._start(origin, builder)
+                    return
+                self.busy.pop(builder, None)
+                if origin in self.done:
+                    return
+                self.done.add(origin)
+                result = (match["result"] or "unknown").lower()
+                if origin not in self.durations:
+                    self._duration(origin, parse_duration(match["elapsed"]))
+                duration = self.durations[origin]
+                key = "built" if result == "success" else result
+                if key in COUNTERS[1:]:
+                    self.counts[key] += 1
+                self._event(
+                    "finish", port=origin, builder=builder, pkg=match["pkg"],
+                    result=result, duration=duration,
+                )
+                self._progress()
+
+            elif match := RE_BUILDERS.search(line):
+                self.counts["queued"] = int(match["queued"])
+                self.builders = int(match["builders"])
+                self._progress()
+
+            elif stats := RE_STATS.findall(line):
+                for key,value in stats:
+                    if (key := key.lower()) in self.counts:
+                        self.counts[key] = int(value)
+                self._progress()
+
+    def port_log(self, origin, end=None):
+        # end is the "build time" line once the port's log has it
+        with self._lock:
+            self._start(origin)
+            if end is not None and (match := RE_BUILD_TIME.search(end)):
+                self._duration(origin, parse_duration(match["time"]))
+
+__all__ = (
+    "BulkProgress",
+    "parse_duration",
+)
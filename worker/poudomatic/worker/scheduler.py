@@ -0,0 +1,113 @@
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from threading import Lock
+
+from .util import Profile,ProcessGroup
+
+log = getLogger("scheduler")
+
+def conflicts(locks, held):
+    for resource,exclusive in locks.items():
+        if (other := held.get(resource)) is not None and (exclusive or other):
+            return True
+    return False
+
+def acquire(held, locks):
+    for resource,exclusive in locks.items():
+        held[resource] = held.get(resource, False) or exclusive
+
+class Scheduler:
+    def __init__(self, env, storage, slots=1):
+        self.env = env
+        self.storage = storage
+        self.slots = slots
+        self._pool = ThreadPoolExecutor(
+            max_workers=slots, thread_name_prefix="task"
+        )
+        self._lock = Lock()
+        self._running = {}
+        # tasks whose leases we keep, until they have been ended
+        self._leased = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, ex_type, ex_value, ex_tb):
+        # tasks run on pool threads where an interrupt never reaches the
+        # commands they wait for; stop those so the tasks can return
+        with self._lock:
+            groups = list(self._running.values())
+        for group in groups:
+            group.stop()
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+    def leased(self):
+        with self._lock:
+            return list(self._leased)
+
+    def _select(self, pending, running):
+        if len(self._running) >= self.slots:
+            return None
+
+        # running includes tasks claimed by other workers on this database
+        held = {}
+        for _,task in running:
+            acquire(held, task.locks())
+
+        for tid,task in pending:
+            locks = task.locks()
+            if not conflicts(locks, held):
+                return tid
+            # tasks further back in the queue may not overtake this one
+            acquire(held, locks)
+
+    def start_next(self):
+        with self._lock:
+            if len(self._running) >= self.slots:
+                return False
+            if (task := self.storage.claim_next(self._select)) is None:
+                return False
+            task_id,task = task
+            group = self._running[task_id] = ProcessGroup()
+            self._leased.add(task_id)
+            self._pool.submit(self._run, task_id, task, group)
+            return True
+
+    def _run(self, task_id, task, group):
+        log.info(f"Starting task {task_id}.")
+        res = None
+        profile = Profile()
+        try:
+            with profile.activate(), group.activate():
+                res = {
+                    "status": "success",
+                    "detail": task.run(self.env, task_id),
+                }
+            log.info(f"Task {task_id} completed successfully.")
+        except Exception as e:
+            if not group.stopped:
+                log.exception(f"Task {task_id} died with exception.")
+            res = { "status": "error", "detail": str(e) }
+        finally:
+            with self._lock:
+                del self._running[task_id]
+            try:
+                if group.stopped:
+                    # the worker is shutting down; let the task run again
+                    log.info(f"Task {task_id} was interrupted.")
+                    self.storage.release_task(task_id)
+                else:
+                    # ending the task wakes up the main loop
+                    self.storage.end_task(task_id, res, profile.summary())
+            except Exception:
+                log.exception(
+                    f"Ending task {task_id} failed; it runs again once its "
+                    f"lease expired."
+                )
+            finally:
+                with self._lock:
+                    self._leased.discard(task_id)
+
+__all__ = (
+    "Scheduler",
+)
@@ -1,13 +1,265 @@
 import anyio
+import json
+import os
 import pickle
+import socket
 import sqlite3
+import zlib
 
-from .util import Watcher
+from collections import defaultdict
+from contextlib import contextmanager
+from heapq import merge
+from logging import getLogger
+from pathlib import Path
+from queue import SimpleQueue, Empty
+from threading import Condition, Event, RLock, Thread
+from time import monotonic, time
+
+from .util.notify import open_notifier
+
+log = getLogger("storage")
 
 if sqlite3.threadsafety != 3:
     raise Exception()
 
+def percentile(values, p):
+    # linear interpolation between the closest ranks of sorted values
+    k = (len(values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+@contextmanager
+def transaction(conn, mode=""):
+    conn.execute(f"BEGIN {mode}")
+    try:
+        yield conn
+    except:
+        conn.execute("ROLLBACK")
+        raise
+    else:
+        conn.execute("COMMIT")
+
+class LogWriter(Thread):
+    def __init__(self, path, batch_size=512, interval=0.2, on_commit=None):
+        super().__init__(name="LogWriter", daemon=True)
+        self._path = path
+        self._on_commit = on_commit
+        self._batch_size = batch_size
+        self._interval = interval
+        self._queue = SimpleQueue()
+
+    def put(self, tid, data, origin=None, kind=None):
+        self._queue.put((tid, data, origin, kind))
+
+    def flush(self):
+        evt = Event()
+        self._queue.put(evt)
+        evt.wait()
+
+    def stop(self):
+        self._queue.put(None)
+        self.join()
+
+    def _write(self, conn, batch):
+        if not batch:
+            return
+        try:
+            with transaction(conn):
+                conn.executemany(
+                    "INSERT INTO log (tid,data,origin,type) VALUES (?,?,?,?)",
+                    batch
+                )
+        except sqlite3.Error:
+            log.exception(f"Dropping {len(batch)} log entries.")
+        else:
+            # flush() waits for this thread, so it must not die here
+            if self._on_commit is not None:
+                try:
+                    self._on_commit()
+                except Exception:
+                    log.exception("Notifying about new log entries failed.")
+        batch.clear()
+
+    def run(self):
+        conn = sqlite3.connect(self._path, isolation_level=None, timeout=30)
+        batch = []
+        deadline = None
+
+        try:
+            while True:
+                try:
+                    if deadline is None:
+                        item = self._queue.get()
+                    else:
+                        item = self._queue.get(
+                            timeout=max(0, deadline - monotonic())
+                        )
+                except Empty:
+                    self._write(conn, batch)
+                    deadline = None
+                    continue
+
+                if item is None:
+                    self._write(conn, batch)
+                    return
+
+                if isinstance(item, Event):
+                    self._write(conn, batch)
+                    deadline = None
+                    item.set()
+                    continue
+
+                batch.append(item)
+                if len(batch) >= self._batch_size:
+                    self._write(conn, batch)
+                    deadline = None
+                elif deadline is None:
+                    deadline = monotonic() + self._interval
+        finally:
+            conn.close()
+
+class Retention(Thread):
+    def __init__(self, storage, interval=300, archive_after=86400,
+                 max_age=None, max_size=None, vacuum_pages=1000,
+                 build_history=100):
+        super().__init__(name="Retention", daemon=True)
+        self._storage = storage
+        self._interval = interval
+        self._archive_after = archive_after
+        self._max_age = max_age
+        self._max_size = max_size
+        self._vacuum_pages = vacuum_pages
+        self._build_history = build_history
+        self._stopping = Event()
+
+    def stop(self):
+        self._stopping.set()
+        self.join()
+
+    def run(self):
+        # use our own connection so the worker loop never waits for us
+        conn = sqlite3.connect(
+            self._storage._path, isolation_level=None, timeout=30
+        )
+        try:
+            while not self._stopping.is_set():
+                try:
+                    self._storage.maintain(
+                        conn,
+                        archive_after=self._archive_after,
+                        max_age=self._max_age,
+                        max_size=self._max_size,
+                        vacuum_pages=self._vacuum_pages,
+                        build_history=self._build_history,
+                        stop=self._stopping,
+                    )
+                except sqlite3.Error:
+                    log.exception("Log maintenance failed.")
+                self._stopping.wait(self._interval)
+        finally:
+            conn.close()
+
+class ReadPool:
+    def __init__(self, path, size=4):
+        self._uri = f"{Path(path).absolute().as_uri()}?mode=ro"
+        self._size = size
+        self._idle = []
+        self._open = 0
+        self._cond = Condition()
+        self._acquired = 0
+        self._waited = 0
+        self._wait_time = 0.0
+        self._max_wait = 0.0
+
+    def _connect(self):
+        return sqlite3.connect(
+            self._uri,
+            uri=True,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+
+    @contextmanager
+    def connection(self):
+        start = monotonic()
+        with self._cond:
+            blocked = not self._idle and self._open >= self._size
+            while not self._idle and self._open >= self._size:
+                self._cond.wait()
+            conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                self._open += 1
+            waited = monotonic() - start
+            self._acquired += 1
+            self._waited += blocked
+            self._wait_time += waited
+            self._max_wait = max(self._max_wait, waited)
+
+        if conn is None:
+            try:
+                conn = self._connect()
+            except:
+                with self._cond:
+                    self._open -= 1
+                    self._cond.notify()
+                raise
+
+        try:
+            yield conn
+        finally:
+            with self._cond:
+                self._idle.append(conn)
+                self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "size": self._size,
+                "open": self._open,
+                "idle": len(self._idle),
+                "acquired": self._acquired,
+                "waited": self._waited,
+                "wait_time": self._wait_time,
+                "max_wait": self._max_wait,
+            }
+
+    def close(self):
+        with self._cond:
+            for conn in self._idle:
+                conn.close()
+            self._open -= len(self._idle)
+            self._idle.clear()
+
+class Heartbeat(Thread):
+    def __init__(self, storage, tasks, interval=None):
+        super().__init__(name="Heartbeat", daemon=True)
+        self._storage = storage
+        # returns the ids of the tasks this worker is still working on
+        self._tasks = tasks
+        self._interval = interval or storage.lease_time / 3
+        self._stopping = Event()
+
+    def stop(self):
+        self._stopping.set()
+        self.join()
+
+    def run(self):
+        conn = sqlite3.connect(
+            self._storage._path, isolation_level=None, timeout=30
+        )
+        try:
+            while not self._stopping.wait(self._interval):
+                try:
+                    self._storage.renew_leases(self._tasks(), conn)
+                except sqlite3.Error:
+                    log.exception("Renewing task leases failed.")
+        finally:
+            conn.close()
+
 class Storage:
+    VERSION = 10
+
     pickle_protocol = 3
     schema = """
         CREATE TABLE IF NOT EXISTS tasks (
@@ -23,9 +275,18 @@ class Storage:
         );
     """
 
-    def __init__(self, path):
+    def __init__(self, path, log_batch_size=512, log_flush_interval=0.2,
+                 notifier="auto", worker_id=None, lease_time=60,
+                 read_connections=4):
         self._path = path
+        self._read_connections = read_connections
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.lease_time = lease_time
         self._conn = None
+        self._notifier_backend = notifier
+        self._lock = RLock()
+        self._log_batch_size = log_batch_size
+        self._log_flush_interval = log_flush_interval
 
     def __enter__(self):
         if self._conn is None:
@@ -33,31 +294,259 @@ class Storage:
                 self._path,
                 isolation_level=None,
                 check_same_thread=False,
+                # the other connections writing to it wait just as long
+                timeout=30,
             )
+            # only takes effect for new databases
+            self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
             self._conn.execute("PRAGMA journal_mode=wal")
             self._conn.executescript(self.schema)
-            self._watcher = Watcher()
-            self._watcher.add(f"{self._path}-wal", Watcher.WRITE)
+            self._upgrade()
+            # older databases keep theirs until they are rebuilt once,
+            # which can't happen inside the upgrade transaction
+            if self._conn.execute("PRAGMA auto_vacuum").fetchone() != (2,):
+                self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                self._conn.execute("VACUUM")
+            # queries don't wait for the writer or each other in WAL mode
+            self._pool = ReadPool(self._path, self._read_connections)
+            self._notifier = open_notifier(
+                f"{self._path}-wal", self._notifier_backend
+            )
+            self._log_writer = LogWriter(
+                self._path,
+                batch_size=self._log_batch_size,
+                interval=self._log_flush_interval,
+                on_commit=self._notifier.notify,
+            )
+            self._log_writer.start()
         return self
 
     def __exit__(self, type, value, traceback):
         if self._conn is not None:
-            self._watcher = None
+            self._log_writer.stop()
+            self._log_writer = None
+            self._notifier.close()
+            self._notifier = None
+            self._pool.close()
+            self._pool = None
             self._conn.close()
             self._conn = None
 
-    def _sql(self, query, *params, results=False):
-        with self._conn:
-            res = self._conn.execute(query, params or ())
-            if results:
-                if isinstance(results, bool):
-                    return res.fetchall()
+    @contextmanager
+    def _transaction(self, mode=""):
+        with self._lock, transaction(self._conn, mode) as conn:
+            yield conn
+
+    def _fetch(self, res, results):
+        if results:
+            if isinstance(results, bool):
+                return res.fetchall()
+            else:
+                if results == 1:
+                    return res.fetchone()
                 else:
-                    if results == 1:
-                        return res.fetchone()
-                    else:
-                        return [res.fetchone() for _ in range(results)]
+                    return [res.fetchone() for _ in range(results)]
+
+    def _sql(self, query, *params, results=False):
+        with self._lock:
+            return self._fetch(
+                self._conn.execute(query, params or ()), results
+            )
+
+    def _read(self, query, *params, results=False):
+        with self._pool.connection() as conn:
+            return self._fetch(conn.execute(query, params or ()), results)
+
+    def stats(self):
+        return {
+            "read_pool": self._pool.stats(),
+        }
+
+    def _upgrade(self):
+        while True:
+            with self._transaction("IMMEDIATE"):
+                version, = self._conn.execute("PRAGMA user_version").fetchone()
+                if version >= self.VERSION:
+                    return
+                getattr(self, f"upgrade_to_{version + 1}")()
+                self._conn.execute(f"PRAGMA user_version={version + 1}")
+
+    def upgrade_to_1(self):
+        # log entries are stored as JSON text instead of pickles
+        self._conn.execute("ALTER TABLE log RENAME TO log_pickle")
+        self._conn.execute("""
+            CREATE TABLE log (
+              tid    VARCHAR(32)  NOT NULL,
+              data   TEXT
+            )
+        """)
+        res = self._conn.execute(
+            "SELECT rowid,tid,data FROM log_pickle ORDER BY rowid"
+        )
+        while rows := res.fetchmany(1024):
+            self._conn.executemany(
+                "INSERT INTO log (rowid,tid,data) VALUES (?,?,?)", [
+                    (rowid, tid,
+                     None if data is None else
+                     self._to_json(self._from_binary(data)))
+                    for rowid,tid,data in rows
+                ]
+            )
+        self._conn.execute("DROP TABLE log_pickle")
+
+    def upgrade_to_2(self):
+        # tasks coalesced at enqueue time point to the task doing the work
+        self._conn.execute(
+            "ALTER TABLE tasks ADD COLUMN merged_into VARCHAR(32)"
+        )
+        self._conn.execute("""
+            CREATE INDEX tasks_merged_into ON tasks(merged_into)
+            WHERE merged_into IS NOT NULL
+        """)
 
+    def upgrade_to_3(self):
+        # origin gets its own column so logs can be filtered by it
+        self._conn.execute("ALTER TABLE log ADD COLUMN origin TEXT")
+        self._conn.execute("""
+            UPDATE log SET origin=json_extract(data, '$.origin')
+            WHERE data IS NOT NULL
+        """)
+        self._conn.execute("CREATE INDEX log_tid_origin ON log(tid, origin)")
+
+    def upgrade_to_4(self):
+        # rowid is implicitly part of every index, so this orders by it
+        self._conn.execute("CREATE INDEX log_tid ON log(tid)")
+
+    def upgrade_to_5(self):
+        # archiving deletes the newest rows as well; their ids must not be
+        # handed out again or /log?after= cursors skip or repeat entries
+        self._conn.execute("ALTER TABLE log RENAME TO log_old")
+        self._conn.execute("""
+            CREATE TABLE log (
+              id     INTEGER      PRIMARY KEY AUTOINCREMENT,
+              tid    VARCHAR(32)  NOT NULL,
+              data   TEXT,
+              origin TEXT
+            )
+        """)
+        self._conn.execute("""
+            INSERT INTO log (id,tid,data,origin)
+            SELECT rowid,tid,data,origin FROM log_old
+        """)
+        self._conn.execute("DROP TABLE log_old")
+        self._conn.execute("CREATE INDEX log_tid_origin ON log(tid, origin)")
+        self._conn.execute("CREATE INDEX log_tid ON log(tid)")
+
+        # logs of finished tasks get compacted into log_archive
+        self._conn.execute("ALTER TABLE tasks ADD COLUMN finished REAL")
+        self._conn.execute(
+            "ALTER TABLE tasks ADD COLUMN archived INTEGER NOT NULL DEFAULT 0"
+        )
+        self._conn.execute(
+            "UPDATE tasks SET finished=? WHERE status=3", (time(),)
+        )
+        self._conn.execute("""
+            CREATE INDEX tasks_unarchived ON tasks(finished)
+            WHERE archived=0
+        """)
+        self._conn.execute("""
+            CREATE TABLE log_archive (
+              tid    VARCHAR(32)  NOT NULL,
+              origin TEXT,
+              data   BLOB         NOT NULL,
+              size   INTEGER      NOT NULL
+            )
+        """)
+        self._conn.execute(
+            "CREATE INDEX log_archive_tid_origin ON log_archive(tid, origin)"
+        )
+
+    def upgrade_to_6(self):
+        # full-text index over log messages; it shares its rowids with log,
+        # which upgrade_to_5 made sure are never reused
+        self._conn.execute("""
+            CREATE VIRTUAL TABLE log_fts USING fts5(
+              msg,
+              tid    UNINDEXED,
+              origin UNINDEXED
+            )
+        """)
+        self._conn.execute("""
+            CREATE TRIGGER log_fts_insert AFTER INSERT ON log
+            WHEN json_extract(new.data, '$.msg') IS NOT NULL
+            BEGIN
+              INSERT INTO log_fts (rowid,msg,tid,origin)
+              VALUES (new.rowid, json_extract(new.data, '$.msg'),
+                      new.tid, new.origin);
+            END
+        """)
+        self._conn.execute("""
+            INSERT INTO log_fts (rowid,msg,tid,origin)
+            SELECT rowid,json_extract(data, '$.msg'),tid,origin FROM log
+            WHERE json_extract(data, '$.msg') IS NOT NULL
+        """)
+        # databases already at version 5 may have archived some logs
+        for tid,origin,blob in self._conn.execute(
+                "SELECT tid,origin,data FROM log_archive"):
+            self._conn.executemany(
+                "INSERT INTO log_fts (rowid,msg,tid,origin) VALUES (?,?,?,?)",
+                [ (rowid, msg, tid, origin)
+                  for rowid,data in self._unpack(blob)
+                  if (msg := json.loads(data).get("msg")) is not None ]
+            )
+
+    def upgrade_to_7(self):
+        # running tasks are leased by a worker and renewed by heartbeat;
+        # tasks left running by earlier versions are reclaimed right away
+        self._conn.execute("ALTER TABLE tasks ADD COLUMN worker TEXT")
+        self._conn.execute("ALTER TABLE tasks ADD COLUMN lease REAL")
+        self._conn.execute("UPDATE tasks SET lease=0 WHERE status=2")
+        self._conn.execute("""
+            CREATE INDEX tasks_pending ON tasks(status)
+            WHERE status=1 AND merged_into IS NULL
+        """)
+        self._conn.execute("""
+            CREATE INDEX tasks_leased ON tasks(lease)
+            WHERE status=2
+        """)
+
+    def upgrade_to_8(self):
+        # commands run by a task, with timings and resource usage
+        self._conn.execute("ALTER TABLE tasks ADD COLUMN profile TEXT")
+
+    def upgrade_to_9(self):
+        # structured events can be read without the text around them
+        self._conn.execute("ALTER TABLE log ADD COLUMN type TEXT")
+        self._conn.execute("""
+            UPDATE log SET type=json_extract(data, '$.type')
+            WHERE data IS NOT NULL
+        """)
+        self._conn.execute("""
+            CREATE INDEX log_tid_events ON log(tid)
+            WHERE type='event'
+        """)
+
+    def upgrade_to_10(self):
+        # how long each port took to build, for estimates and scheduling
+        self._conn.execute("""
+            CREATE TABLE build_times (
+              origin       TEXT        NOT NULL,
+              jail         TEXT        NOT NULL,
+              ports_branch TEXT        NOT NULL,
+              pkgbase      TEXT,
+              duration     REAL        NOT NULL,
+              result       TEXT        NOT NULL,
+              tid          VARCHAR(32),
+              finished     REAL        NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE INDEX build_times_origin
+            ON build_times(origin, jail, ports_branch, finished)
+        """)
+
+    def _to_json(self, data):
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
 
     def _to_binary(self, data):
         return sqlite3.Binary(pickle.dumps(data, self.pickle_protocol))
@@ -65,44 +554,168 @@ class Storage:
     def _from_binary(self, data):
         return pickle.loads(data)
 
-    def wait_for_changes(self):
-        self._watcher.wait()
+    def wait_for_changes(self, timeout=None):
+        self._notifier.wait(timeout)
 
-    def start_next_task(self):
-        with self._conn:
-            res = self._conn.execute("""
+    async def async_wait_for_changes(self):
+        await self._notifier.async_wait()
+
+    def _reclaim(self, conn, now):
+        for tid,worker in conn.execute(
+                "SELECT tid,worker FROM tasks WHERE status=2 AND lease<?",
+                (now,)).fetchall():
+            log.warning(f"Lease of {worker} on task {tid} expired.")
+            conn.execute(
+                "UPDATE tasks SET status=1,worker=NULL,lease=NULL WHERE tid=?",
+                (tid,)
+            )
+
+    def _unpickled(self, cursor, seen):
+        # tasks are only unpickled as far as the selector looks at them
+        for tid,data in cursor:
+            seen[tid] = self._from_binary(data)
+            yield (tid, seen[tid])
+
+    def claim_next(self, select):
+        now = time()
+        # every log flush wakes the workers up; don't take the write lock
+        # unless there is something to claim
+        if not self._read("""
+                SELECT EXISTS(
+                  SELECT 1 FROM tasks WHERE status=1 AND merged_into IS NULL
+                ) OR EXISTS(
+                  SELECT 1 FROM tasks WHERE status=2 AND lease<?
+                )
+            """, now, results=1)[0]:
+            return None
+
+        with self._transaction("IMMEDIATE") as conn:
+            self._reclaim(conn, now)
+            pending = {}
+            pending_cursor = conn.execute("""
                 SELECT tid,data
                 FROM tasks
-                WHERE status=1
-                ORDER BY rowid LIMIT 1
+                WHERE status=1 AND merged_into IS NULL
+                ORDER BY rowid
             """)
-            if (task := res.fetchone()) is None:
+            # tasks running in any worker sharing this database
+            running_cursor = conn.execute(
+                "SELECT tid,data FROM tasks WHERE status=2"
+            )
+            tid = select(
+                self._unpickled(pending_cursor, pending),
+                self._unpickled(running_cursor, {}),
+            )
+            pending_cursor.close()
+            running_cursor.close()
+            if tid is None:
                 return None
-            tid,data = task
-            self._conn.execute(
-                "UPDATE tasks SET status=2 WHERE tid=?",
-                (tid,)
+            conn.execute(
+                "UPDATE tasks SET status=2,worker=?,lease=? WHERE tid=?",
+                (self.worker_id, now + self.lease_time, tid)
             )
-            return (tid, self._from_binary(data))
+        self._notifier.notify()
+        return (tid, pending[tid])
 
-    def end_task(self, tid, result=None):
-        self._sql(
-            "UPDATE tasks SET status=3,result=? WHERE tid=?",
-            None if result is None else self._to_binary(result), tid
+    def start_next_task(self):
+        return self.claim_next(
+            lambda pending, running: next(pending, (None,))[0]
         )
-        self._sql("INSERT INTO log VALUES (?, NULL)", tid)
 
-    def enqueue(self, tid, data):
-        self._sql(
-            "INSERT INTO tasks (tid,data) VALUES (?,?)",
-            tid, self._to_binary(data)
-        )
+    def renew_leases(self, tids, conn=None):
+        # only tasks still being worked on; the lease of a task that could
+        # not be ended runs out and it is picked up again
+        if not tids:
+            return
+        with (self._transaction() if conn is None else
+              transaction(conn)) as conn:
+            conn.execute("""
+                UPDATE tasks SET lease=?
+                WHERE status=2 AND worker=?
+                  AND tid IN (SELECT value FROM json_each(?))
+            """, (time() + self.lease_time, self.worker_id,
+                  self._to_json(list(tids))))
+
+    def release_task(self, tid):
+        # hand a claimed task back to the queue without a result
+        with self._transaction("IMMEDIATE") as conn:
+            conn.execute(
+                "UPDATE tasks SET status=1,worker=NULL,lease=NULL "
+                "WHERE tid=? AND status=2 AND worker=?",
+                (tid, self.worker_id)
+            )
+        self._notifier.notify()
+
+    def end_task(self, tid, result=None, profile=None):
+        # make sure all log entries are written before the end marker
+        self._log_writer.flush()
+        with self._transaction("IMMEDIATE") as conn:
+            # the lease expired and the task was reclaimed, maybe even
+            # claimed by another worker already
+            if conn.execute(
+                    "SELECT worker FROM tasks WHERE tid=? AND status=2",
+                    (tid,)).fetchone() != (self.worker_id,):
+                log.warning(f"Lost the lease on task {tid}, not ending it.")
+                return
+            conn.execute(
+                "UPDATE tasks SET status=3,result=?,finished=?,lease=NULL "
+                "WHERE tid=? OR merged_into=?",
+                (None if result is None else self._to_binary(result), time(),
+                 tid, tid)
+            )
+            if profile is not None:
+                conn.execute(
+                    "UPDATE tasks SET profile=? WHERE tid=?",
+                    (self._to_json(profile), tid)
+                )
+            conn.execute("INSERT INTO log (tid,data) VALUES (?,NULL)", (tid,))
+        self._notifier.notify()
+
+    def _coalesce(self, conn, tid, data):
+        for target,other in conn.execute("""
+                SELECT tid,data
+                FROM tasks
+                WHERE status=1 AND merged_into IS NULL
+                ORDER BY rowid
+            """).fetchall():
+            if (merged := self._from_binary(other).coalesce(data)) is None:
+                continue
+            conn.execute(
+                "UPDATE tasks SET data=? WHERE tid=?",
+                (self._to_binary(merged), target)
+            )
+            conn.execute(
+                "INSERT INTO tasks (tid,data,merged_into) VALUES (?,?,?)",
+                (tid, self._to_binary(data), target)
+            )
+            return target
+
+    def enqueue(self, tid, data, coalesce=False):
+        with self._transaction("IMMEDIATE") as conn:
+            if not coalesce or (target := self._coalesce(conn, tid, data)) is None:
+                conn.execute(
+                    "INSERT INTO tasks (tid,data) VALUES (?,?)",
+                    (tid, self._to_binary(data))
+                )
+                target = tid
+        self._notifier.notify()
+        return target
+
+    def _log_tid(self, tid):
+        if (res := self._read(
+                "SELECT COALESCE(merged_into,tid) FROM tasks WHERE tid=?",
+                tid, results=1)) is not None:
+            return res[0]
+        return tid
 
     def get_result(self, tid):
-        result = self._sql(
-            "SELECT status,result FROM tasks WHERE tid=?",
-            tid, results=1
-        )
+        # coalesced tasks report the state of the task doing the work
+        result = self._read("""
+            SELECT t.status,t.result
+            FROM tasks m
+            JOIN tasks t ON t.tid=COALESCE(m.merged_into,m.tid)
+            WHERE m.tid=?
+        """, tid, results=1)
         if result is not None:
             status,result = result
             return (
@@ -110,43 +723,348 @@ class Storage:
                 None if result is None else self._from_binary(result),
             )
 
+    def get_profile(self, tid):
+        return self._read("""
+            SELECT t.profile
+            FROM tasks m
+            JOIN tasks t ON t.tid=COALESCE(m.merged_into,m.tid)
+            WHERE m.tid=?
+        """, tid, results=1)
+
+    def add_build_time(self, tid, jail, ports_branch, origin, duration,
+                       result, pkgbase=None):
+        self._sql("""
+            INSERT INTO build_times
+              (origin,jail,ports_branch,pkgbase,duration,result,tid,finished)
+            VALUES (?,?,?,?,?,?,?,?)
+        """, origin, jail, ports_branch, pkgbase, duration, result, tid,
+            time())
+
+    def build_time_percentiles(self, origins=None, jail=None,
+                               ports_branch=None, percentiles=(50, 90),
+                               result="success", history=20):
+        # the latest builds of each origin; builds on other jails or ports
+        # branches only count for origins never built on the requested one
+        res = self._read("""
+            SELECT origin,duration,pkgbase FROM (
+              SELECT origin,duration,pkgbase,exact,
+                     MAX(exact) OVER (PARTITION BY origin) AS best,
+                     ROW_NUMBER() OVER (
+                       PARTITION BY origin,exact ORDER BY finished DESC
+                     ) AS n
+              FROM (
+                SELECT origin,duration,pkgbase,finished,
+                       (?1 IS NULL OR jail=?1) AND
+                       (?2 IS NULL OR ports_branch=?2) AS exact
+                FROM build_times
+                WHERE (?3 IS NULL OR result=?3)
+                  AND (?4 IS NULL OR
+                       origin IN (SELECT value FROM json_each(?4)))
+              )
+            )
+            WHERE exact=best AND n<=?5
+            ORDER BY origin,n
+        """, jail, ports_branch, result,
+            None if origins is None else self._to_json(list(origins)),
+            history, results=True)
+
+        durations = defaultdict(list)
+        pkgbases = {}
+        for origin,duration,pkgbase in res:
+            durations[origin].append(duration)
+            pkgbases.setdefault(origin, pkgbase)
+
+        stats = {}
+        for origin,values in durations.items():
+            values.sort()
+            stats[origin] = {
+                "pkgbase": pkgbases[origin],
+                "builds": len(values),
+                **{ f"p{p:g}": percentile(values, p) for p in percentiles },
+            }
+        return stats
+
+    async def wait_result(self, tid, timeout=0):
+        result = await anyio.to_thread.run_sync(self.get_result, tid)
+        with anyio.move_on_after(timeout):
+            while result is not None and result[0] != 3:
+                await self.async_wait_for_changes()
+                result = await anyio.to_thread.run_sync(self.get_result, tid)
+        return result
+
     def add_log(self, tid, data):
         if data is None:
             raise Exception()
-        self._sql(
-            "INSERT INTO log VALUES (?,?)",
-            tid, self._to_binary(data)
+        self._log_writer.put(
+            tid, self._to_json(data), data.get("origin"), data.get("type")
         )
 
-    def _get_log_sync(self, tid, start=0):
+    def _pack(self, entries):
+        return zlib.compress(
+            "\n".join(f"{rowid}\t{data}" for rowid,data in entries).encode()
+        )
+
+    def _unpack(self, blob):
+        for line in zlib.decompress(blob).decode().split("\n"):
+            rowid,_,data = line.partition("\t")
+            yield (int(rowid), data)
+
+    def _archive_task(self, conn, tid):
+        # finished tasks get no new entries; read and compress the log
+        # before taking the write lock
+        origins = {}
+        last = None
+        for rowid,origin,data in conn.execute("""
+                SELECT rowid,origin,data FROM log
+                WHERE tid=?
+                ORDER BY rowid
+            """, (tid,)):
+            last = rowid
+            if data is not None:
+                origins.setdefault(origin, []).append((rowid, data))
+        blobs = []
+        for origin,entries in origins.items():
+            blob = self._pack(entries)
+            blobs.append((tid, origin, blob, len(blob)))
+
+        with transaction(conn, "IMMEDIATE"):
+            # the log changed in between, maybe another worker archived it
+            if conn.execute(
+                    "SELECT MAX(rowid) FROM log WHERE tid=?",
+                    (tid,)).fetchone() != (last,):
+                return
+            conn.executemany(
+                "INSERT INTO log_archive VALUES (?,?,?,?)", blobs
+            )
+            conn.execute("DELETE FROM log WHERE tid=?", (tid,))
+            conn.execute("UPDATE tasks SET archived=1 WHERE tid=?", (tid,))
+
+    def _purge_tasks(self, conn, tids, stop=None):
+        # one task per transaction to keep write locks short
+        for tid in tids:
+            if stop is not None and stop.is_set():
+                return
+            # tid isn't indexed in log_fts, so delete by rowid
+            rowids = [
+                (rowid,) for rowid, in conn.execute(
+                    "SELECT rowid FROM log WHERE tid=?", (tid,)
+                )
+            ]
+            for blob, in conn.execute(
+                    "SELECT data FROM log_archive WHERE tid=?", (tid,)):
+                rowids.extend((rowid,) for rowid,_ in self._unpack(blob))
+            with transaction(conn, "IMMEDIATE"):
+                conn.executemany("DELETE FROM log_fts WHERE rowid=?", rowids)
+                conn.execute("DELETE FROM log_archive WHERE tid=?", (tid,))
+                conn.execute("DELETE FROM log WHERE tid=?", (tid,))
+                conn.execute("UPDATE tasks SET archived=1 WHERE tid=?", (tid,))
+
+    def maintain(self, conn, archive_after=86400, max_age=None,
+                 max_size=None, vacuum_pages=1000, build_history=100,
+                 stop=None):
+        now = time()
+
+        # compact one task per transaction to keep write locks short
+        for tid, in conn.execute("""
+                SELECT tid FROM tasks
+                WHERE archived=0 AND status=3 AND finished<?
+                ORDER BY finished
+            """, (now - archive_after,)).fetchall():
+            if stop is not None and stop.is_set():
+                return
+            self._archive_task(conn, tid)
+
+        if max_age is not None:
+            self._purge_tasks(conn, [
+                tid for tid, in conn.execute("""
+                    SELECT DISTINCT tid FROM log_archive
+                    JOIN tasks USING (tid)
+                    WHERE finished<?
+                """, (now - max_age,)).fetchall()
+            ], stop)
+
+        if max_size is not None:
+            total, = conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM log_archive"
+            ).fetchone()
+            expired = []
+            for tid,size in conn.execute("""
+                    SELECT tid,SUM(size) FROM log_archive
+                    JOIN tasks USING (tid)
+                    GROUP BY tid
+                    ORDER BY finished
+                """).fetchall():
+                if total <= max_size:
+                    break
+                expired.append(tid)
+                total -= size
+            self._purge_tasks(conn, expired, stop)
+
+        # estimates only look at the latest builds of each port
+        if build_history is not None:
+            with transaction(conn, "IMMEDIATE"):
+                conn.execute("""
+                    DELETE FROM build_times WHERE rowid IN (
+                        SELECT rowid FROM (
+                            SELECT rowid, ROW_NUMBER() OVER (
+                                PARTITION BY origin,jail,ports_branch
+                                ORDER BY finished DESC
+                            ) AS n FROM build_times
+                        ) WHERE n>?
+                    )
+                """, (build_history,))
+
+        # execute() only runs a single step, freeing a single page
+        conn.executescript(f"PRAGMA incremental_vacuum({int(vacuum_pages)})")
+
+    def _get_archived_log(self, tid, origin=None, kind=None):
+        if origin is not None:
+            blobs = self._read(
+                "SELECT data FROM log_archive WHERE tid=? AND origin=?",
+                tid, origin, results=True
+            )
+        else:
+            blobs = self._read(
+                "SELECT data FROM log_archive WHERE tid=?",
+                tid, results=True
+            )
+        entries = merge(*(self._unpack(blob) for blob, in blobs))
+        if kind is not None:
+            entries = (
+                (rowid, data) for rowid,data in entries
+                if json.loads(data).get("type") == kind
+            )
+        return list(entries)
+
+    def _log_filter(self, origin=None, kind=None):
+        sql = ""
+        params = []
+        if origin is not None:
+            sql += " AND origin=?"
+            params.append(origin)
+        if kind == "event":
+            # only a literal lets sqlite use the partial index
+            sql += " AND type='event'"
+        elif kind is not None:
+            sql += " AND type=?"
+            params.append(kind)
+        return (sql, params)
+
+    def _get_log_sync(self, tid, start=0, origin=None, limit=None, kind=None):
+        status,archived = self._read(
+            "SELECT status,archived FROM tasks WHERE tid=?", tid, results=1
+        ) or (None, False)
+
+        if archived:
+            results = [
+                entry for entry in self._get_archived_log(tid, origin, kind)
+                if entry[0] > start
+            ]
+            if limit is not None and len(results) > limit:
+                return (False, results[:limit])
+            return (True, results)
+
+        limit = -1 if limit is None else limit
+
+        if origin is not None or kind is not None:
+            # the end marker has no origin or type; once the task has ended
+            # all of its entries are written, and we checked the status first
+            sql,params = self._log_filter(origin, kind)
+            results = self._read(f"""
+                SELECT rowid,data FROM log
+                WHERE tid=?{sql} AND rowid>?
+                ORDER BY rowid ASC LIMIT ?
+            """, tid, *params, start, limit, results=True)
+            return (status == 3 and len(results) != limit, results)
+
         complete = False
         results = []
 
-        for rowid,data in self._sql(
-                "SELECT rowid,data FROM log WHERE tid=? AND rowid>? ORDER BY rowid ASC",
-                tid, start, results=True
-            ):
+        for rowid,data in self._read("""
+                SELECT rowid,data FROM log
+                WHERE tid=? AND rowid>?
+                ORDER BY rowid ASC LIMIT ?
+            """, tid, start, limit, results=True):
             if data is None:
                 complete = True
                 break
-            results.append((rowid, self._from_binary(data)))
+            results.append((rowid, data))
 
         return (complete, results)
 
-    async def _get_log(self,  tid, start=0):
-        return await anyio.to_thread.run_sync(self._get_log_sync, tid, start)
+    def _tail_start_sync(self, tid, count, origin=None, kind=None):
+        if self._read("SELECT archived FROM tasks WHERE tid=?",
+                     tid, results=1) == (1,):
+            entries = self._get_archived_log(tid, origin, kind)
+            return entries[-count - 1][0] if count < len(entries) else 0
 
-    async def get_log(self, tid, start=0):
-        _,entries = await self._get_log(tid, start)
+        if origin is not None or kind is not None:
+            sql,params = self._log_filter(origin, kind)
+            res = self._read(f"""
+                SELECT rowid FROM log
+                WHERE tid=?{sql}
+                ORDER BY rowid DESC LIMIT 1 OFFSET ?
+            """, tid, *params, count, results=1)
+        else:
+            res = self._read("""
+                SELECT rowid FROM log
+                WHERE tid=? AND data IS NOT NULL
+                ORDER BY rowid DESC LIMIT 1 OFFSET ?
+            """, tid, count, results=1)
+        return 0 if res is None else res[0]
+
+    def _search_sync(self, query, tid=None, origin=None, limit=100):
+        # match the query as a phrase so punctuation like "error:" is
+        # not taken for FTS syntax
+        sql = "SELECT rowid,tid,origin,msg FROM log_fts WHERE log_fts MATCH ?"
+        params = [ '"{}"'.format(query.replace('"', '""')) ]
+        if tid is not None:
+            sql += " AND tid=?"
+            params.append(self._log_tid(tid))
+        if origin is not None:
+            sql += " AND origin=?"
+            params.append(origin)
+        sql += " ORDER BY rowid LIMIT ?"
+        params.append(limit)
+        return self._read(sql, *params, results=True)
+
+    async def search(self, query, tid=None, origin=None, limit=100):
+        return await anyio.to_thread.run_sync(
+            self._search_sync, query, tid, origin, limit
+        )
+
+    async def _get_log(self, tid, start=0, origin=None, limit=None,
+                       kind=None):
+        return await anyio.to_thread.run_sync(
+            self._get_log_sync, tid, start, origin, limit, kind
+        )
+
+    async def log_start(self, tid, start=0, origin=None, tail=None,
+                        kind=None):
+        if tail is None:
+            return start
+        return max(start, await anyio.to_thread.run_sync(
+            self._tail_start_sync, tid, tail, origin, kind
+        ))
+
+    async def get_log(self, tid, start=0, origin=None, limit=None, tail=None,
+                      kind=None):
+        tid = await anyio.to_thread.run_sync(self._log_tid, tid)
+        start = await self.log_start(tid, start, origin, tail, kind)
+        _,entries = await self._get_log(tid, start, origin, limit, kind)
         return entries
 
-    async def watch_log(self, tid, running=None):
-        maxid = 0
+    async def watch_log(self, tid, running=None, origin=None,
+                        start=0, tail=None, kind=None):
+        tid = await anyio.to_thread.run_sync(self._log_tid, tid)
+        maxid = await self.log_start(tid, start, origin, tail, kind)
         while running is not None and await running():
-            complete,entries = await self._get_log(tid, maxid)
+            complete,entries = await self._get_log(
+                tid, maxid, origin, kind=kind
+            )
             for id,data in entries:
                 maxid = max(maxid, id)
                 yield id,data
             if complete:
                 return
-            await self._watcher.async_wait()
+            await self.async_wait_for_changes()
@@ -1,7 +1,6 @@
 from collections import defaultdict
 from contextlib import contextmanager
 from logging import getLogger
-from concurrent.futures import ThreadPoolExecutor, wait
 from pathlib import Path
 from pydantic import BaseModel, Field
 from re import compile as regex
@@ -9,8 +8,9 @@ from shutil import copyfile
 from typing import Literal, Optional, Union
 
 from . import files
+from .progress import BulkProgress
 from .srctree import SourceTree
-from .util import zfs,git,process,DirectoryFollower
+from .util import zfs,git,process,CommandError,open_follower
 from .versions import *
 
 
@@ -25,10 +25,27 @@ class Model(BaseModel):
             return field.name
         return super()._get_value(field, **kwargs)
 
+    def locks(self):
+        return {}
+
+    def coalesce(self, other):
+        return None
+
 
 class CreateJailTask(Model):
     version: FreeBSDVersion
 
+    def locks(self):
+        return {
+            ("jail", self.version.shortname): True,
+            # buildworld always happens in /usr/obj
+            ("src", "/usr/obj"): True,
+        }
+
+    def coalesce(self, other):
+        if isinstance(other, CreateJailTask) and other.version == self.version:
+            return self
+
     def run(self, env, task_id):
         log = getLogger("create_jail")
 
@@ -60,6 +77,15 @@ class CreateJailTask(Model):
 class UpdatePortsTask(Model):
     branch: PortsBranchVersion
 
+    def locks(self):
+        return {
+            ("ports", self.branch.name): True,
+        }
+
+    def coalesce(self, other):
+        if isinstance(other, UpdatePortsTask) and other.branch == self.branch:
+            return self
+
     def run(self, env, task_id):
         if (ports := env.get_portsbranch(self.branch)) is not None:
             snap = ports.snap
@@ -93,6 +119,19 @@ class UpdatePortsTask(Model):
         return env.get_portsbranch(self.branch)
 
 
+def unique(items):
+    return list(dict.fromkeys(items))
+
+def build_locks(jail_version, ports_branch):
+    jail = jail_version.shortname
+    ports = ports_branch.name
+    return {
+        ("jail", jail): False,
+        ("ports", ports): False,
+        # poudriere uses the same build name for each jail/ports pair
+        ("packages", f"{jail}-{ports}"): True,
+    }
+
 @contextmanager
 def prepare_build(env, task_id, logfunc, jail_version, ports_branch, targets):
     jail = env.get_jail(jail_version)
@@ -134,7 +173,26 @@ class RunBuildTask(Model):
     portja_targets: list[str]
     origins: list[str]
 
-    END_PKG = regex(r"build time: .{8}")
+    END_PKG = regex(rb"build time: .{8}")
+
+    def locks(self):
+        return build_locks(self.jail_version, self.ports_branch)
+
+    def coalesce(self, other):
+        if not isinstance(other, RunBuildTask):
+            return None
+        if other.jail_version != self.jail_version:
+            return None
+        if other.ports_branch != self.ports_branch:
+            return None
+        # without origins the generated ports are built; we can't mix
+        # that with a build of explicit origins
+        if bool(other.origins) != bool(self.origins):
+            return None
+        return self.copy(update={
+            "portja_targets": unique(self.portja_targets + other.portja_targets),
+            "origins": unique(self.origins + other.origins),
+        })
 
     def run(self, env, task_id):
         log = getLogger("run_build")
@@ -172,34 +230,89 @@ class RunBuildTask(Model):
             pname = portstree.name
             pkgdeps = None
 
-            with ThreadPoolExecutor(max_workers=1) as pool:
-                buildlogs = pourdiere.get_buildlogbase(jname, pname)
-                buildlogs.mkdir(parents=True)
-                follow = DirectoryFollower(buildlogs)
-
-                # start pourdiere in thread
-                def run():
-                    pourdiere.bulk(
-                        "-j", jname, "-p", pname, "-N", *origins,
-                        logfunc=log_progress
+            # start the longest ports first so that none of them ends up
+            # building alone at the end; poudriere orders its queue by
+            # itself, so the ones that take really long are boosted too
+            history = stor.build_time_percentiles(
+                origins, jail=jail_version.shortname,
+                ports_branch=ports_branch.name,
+            )
+            estimates = {
+                origin: stats["p50"] for origin,stats in history.items()
+            }
+            origins = sorted(
+                origins, key=lambda origin: estimates.get(origin, 0),
+                reverse=True
+            )
+            boost_time = float(env.get_config(
+                "build", "priority_boost_time", default=1800))
+            pourdiere.set_priority_boost(sorted(
+                stats["pkgbase"] for stats in history.values()
+                if stats["pkgbase"] and stats["p50"] >= boost_time
+            ))
+
+            def emit(event):
+                # typed events go into the log next to the text they come from
+                stor.add_log(task_id, event)
+                if event["event"] == "finish":
+                    pkg = event["pkg"]
+                    stor.add_build_time(
+                        task_id, jail_version.shortname, ports_branch.name,
+                        event["port"], event["duration"], event["result"],
+                        None if pkg is None else pkg.rpartition("-")[0],
                     )
-                    follow.close()
 
-                pool.submit(run)
+            buildlogs = pourdiere.get_buildlogbase(jname, pname)
+            buildlogs.mkdir(parents=True)
+            follow = open_follower(buildlogs)
+            progress = BulkProgress(emit, estimates)
+
+            # pourdiere runs on the environment's shared runner
+            bulk = pourdiere.start_bulk(
+                env.runner, "-j", jname, "-p", pname, "-N", *origins,
+                logfunc=log_progress,
+                progress=progress,
+                on_exit=lambda job: follow.close(),
+            )
 
-                # watch files in main thread
-                for filename,line in follow:
+            async def follow_logs():
+                nonlocal pkgdeps
+                async for filename,lines in follow.async_batches():
                     if pkgdeps is None:
                         pkgdeps = pourdiere.read_pkg_deps(jname, pname)
-
-                    log_progress(
-                        line.rstrip(),
-                        origin=pkgdeps.pkgmap[filename.with_suffix("").name]
+                        # the queue is known once the first port started
+                        progress.plan(
+                            pourdiere.read_depgraph(jname, pname),
+                            pourdiere.read_bulk_stats(jname, pname).queued,
+                        )
+
+                    origin = pkgdeps.pkgmap[filename.with_suffix("").name]
+                    for line in lines:
+                        log_progress(follow.decode(line).rstrip(), origin)
+
+                    end = next(
+                        (line for line in lines if self.END_PKG.match(line)),
+                        None
                     )
-
-                    if self.END_PKG.match(line):
+                    progress.port_log(
+                        origin, None if end is None else follow.decode(end)
+                    )
+                    if end is not None:
                         follow.remove(filename)
 
+            try:
+                # the followers of all builds share the environment's loop
+                env.loop.call(follow_logs)
+            except:
+                bulk.cancel()
+                raise
+
+            # failed packages are reported through the stats
+            try:
+                bulk.wait()
+            except CommandError:
+                pass
+
             stats = pourdiere.read_bulk_stats(jname, pname)
             if pkgdeps is None:
                 pkgdeps = pourdiere.read_pkg_deps(jname, pname)
@@ -247,6 +360,9 @@ class GetDependsTask(Model):
     origin: str
     portja_target: Optional[str] = None
 
+    def locks(self):
+        return build_locks(self.jail_version, self.ports_branch)
+
     def run(self, env, task_id):
         log = getLogger("get_depends")
 
@@ -254,16 +370,23 @@ class GetDependsTask(Model):
         ports_branch = self.ports_branch
         targets = [] if self.portja_target is None else [self.portja_target]
 
-        with prepare_build(env, task_id, log, jail_version, ports_branch, targets) \
+        with prepare_build(env, task_id, log.info, jail_version,
+                           ports_branch, targets) \
                as (generated, pourdiere, jail, portstree):
             errors = pourdiere.bulk(
                 "-j", jail.name, "-p", portstree.name, "-n", self.origin,
-                logger=log
+                logfunc=log.info
             )
             if errors:
                 raise Exception("; ".join(errors))
 
-        return pourdiere.read_bulk_stats().depends
+            # the dry run leaves poudriere's dependency files behind
+            graph = pourdiere.read_depgraph(jail.name, portstree.name)
+
+        return {
+            "depends": graph.to_depends(),
+            "levels": graph.levels(),
+        }
 
 
 __all__ = (
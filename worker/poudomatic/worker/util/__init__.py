@@ -1,4 +1,5 @@
-from . import git
-from . import zfs
-from .process import process,shquote,CommandError
+from .process import process,shquote,CommandError,Profile,ProcessGroup
 from .kq import *
+from .follow import open_follower
+from .runner import Job,Runner
+from .loop import EventLoop
@@ -0,0 +1,247 @@
+import anyio
+import codecs
+import os
+import pathlib
+import re
+import select
+import stat
+import sys
+import threading
+
+from abc import ABC, abstractmethod
+
+RE_LINEBREAK = re.compile(br"\r\n|\n|\r")
+
+# anyio >= 4.7 renamed wait_socket_readable and accepts any file descriptor
+wait_readable = getattr(anyio, "wait_readable", anyio.wait_socket_readable)
+
+class LineReader:
+    def __init__(self, fp, bufsize=65536):
+        self.fp = fp
+        self._buf = bytearray(bufsize)
+        self._view = memoryview(self._buf)
+        self._fill = 0
+        self._skip_lf = False
+
+    def read(self, limit):
+        # returns complete lines as bytes and whether data was left unread
+        lines = []
+        total = 0
+        while total < limit:
+            n = self.fp.readinto(self._view[self._fill:])
+            if not n:
+                return (lines, False)
+            total += n
+            if self._skip_lf:
+                self._skip_lf = False
+                if self._buf[0] == 0x0a:
+                    self._buf[:n - 1] = self._view[1:n].tobytes()
+                    n -= 1
+            end = self._fill + n
+            if not end:
+                continue
+            # a trailing CR might be the first half of a CRLF
+            keep = 1 if self._buf[end - 1] == 0x0d else 0
+            *complete,last = RE_LINEBREAK.split(self._view[:end - keep])
+            if not complete and end == len(self._buf):
+                if keep:
+                    # the CR ends a line that fills the buffer exactly; a
+                    # LF coming after it belongs to it
+                    lines.append(bytes(self._view[:end - 1]))
+                    self._skip_lf = True
+                else:
+                    # overlong lines are cut at the buffer size
+                    lines.append(bytes(self._buf))
+                self._fill = 0
+                continue
+            lines.extend(complete)
+            self._fill = len(last) + keep
+            self._buf[:self._fill] = self._buf[end - self._fill:end]
+        return (lines, True)
+
+class Follower(ABC):
+    def __init__(self, path, bufsize=65536, max_read=1 << 20):
+        self._path = pathlib.Path(path).resolve()
+        self._pathfd = os.open(
+            self._path, os.O_RDONLY | getattr(os, "O_DIRECTORY", 0)
+        )
+        self._bufsize = bufsize
+        self._max_read = max_read
+
+        self._files = {}
+        self._fds = {}
+        # names of all entries ever looked at, including removed files
+        self._seen = set()
+        # files with data left unread after max_read
+        self._unread = set()
+
+        self._closed = False
+        self._closing = False
+        self._to_remove = set()
+        self._lock = threading.Lock()
+        self._decoder = codecs.getdecoder(sys.getdefaultencoding())
+
+    def __del__(self):
+        if self._pathfd is not None:
+            os.close(self._pathfd)
+            self._pathfd = None
+
+    def __bool__(self):
+        return not self._closed
+
+    def decode(self, b):
+        return self._decoder(b, "replace")[0]
+
+    # backends implement these
+    @abstractmethod
+    def fileno(self):
+        # readable whenever _poll() has something to report
+        pass
+
+    @abstractmethod
+    def _poll(self, timeout):
+        # returns whether the directory changed and the readable fds
+        pass
+
+    def _watch(self, fd, name):
+        pass
+
+    def _unwatch(self, fd, name):
+        pass
+
+    @abstractmethod
+    def _wakeup(self):
+        pass
+
+    def close(self):
+        # may be called from any thread; remaining data is still read
+        with self._lock:
+            self._closing = True
+        self._wakeup()
+
+    def remove(self, filename):
+        with self._lock:
+            self._to_remove.add(filename)
+        self._wakeup()
+
+    def _scan(self):
+        # set difference on the plain names keeps the per-event work in C;
+        # only entries not seen before are looked at individually
+        new = set(os.listdir(self._pathfd))
+        new.difference_update(self._seen)
+        self._seen.update(new)
+        for name in new:
+            try:
+                st = os.stat(name, dir_fd=self._pathfd, follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            if stat.S_ISREG(st.st_mode):
+                yield name
+
+    def _open(self, name):
+        try:
+            fd = os.open(name, os.O_RDONLY, dir_fd=self._pathfd)
+        except FileNotFoundError:
+            return None
+        fp = open(fd, mode="rb", buffering=0)
+        filename = self._path / name
+        self._files[filename] = fd
+        self._fds[fd] = (LineReader(fp, self._bufsize), filename)
+        self._watch(fd, name)
+        return fd
+
+    def _close(self, fd):
+        reader,filename = self._fds.pop(fd)
+        self._unwatch(fd, filename.name)
+        reader.fp.close()
+        self._unread.discard(fd)
+        del self._files[filename]
+
+    def _read(self, fd, limit=None):
+        reader,filename = self._fds[fd]
+        lines,more = reader.read(limit or self._max_read)
+        if more:
+            self._unread.add(fd)
+        else:
+            self._unread.discard(fd)
+        return (filename, lines)
+
+    def wait(self, timeout=None):
+        # no new event arrives for data we left unread
+        ready = self._unread.copy()
+        if ready:
+            timeout = 0
+
+        changed,readable = self._poll(timeout)
+        ready.update(readable)
+
+        with self._lock:
+            closing = self._closing
+            to_remove,self._to_remove = self._to_remove,set()
+
+        if changed or closing:
+            # new files may already hold data no event will tell us about
+            for name in self._scan():
+                if (fd := self._open(name)) is not None:
+                    ready.add(fd)
+
+        for filename in to_remove:
+            if (fd := self._files.get(filename)) is not None:
+                ready.discard(fd)
+                self._close(fd)
+
+        for fd in ready:
+            if fd in self._fds:
+                filename,lines = self._read(fd)
+                if lines:
+                    yield (filename, lines)
+
+        if closing:
+            # the writers are done; read what's left and stop
+            for fd in list(self._fds):
+                filename,lines = self._read(fd, sys.maxsize)
+                if lines:
+                    yield (filename, lines)
+                self._close(fd)
+            self._closed = True
+
+    def batches(self):
+        while self:
+            yield from self.wait()
+
+    def __iter__(self):
+        for filename,lines in self.batches():
+            for line in lines:
+                yield (filename, self.decode(line))
+
+    async def async_batches(self):
+        while self:
+            if not self._unread:
+                await wait_readable(self.fileno())
+            for batch in self.wait(timeout=0):
+                yield batch
+
+    async def __aiter__(self):
+        async for filename,lines in self.async_batches():
+            for line in lines:
+                yield (filename, self.decode(line))
+
+def open_follower(path, backend="auto", **kwargs):
+    if backend == "auto":
+        if hasattr(select, "kqueue"):
+            backend = "kqueue"
+        elif sys.platform.startswith("linux"):
+            backend = "inotify"
+    if backend == "kqueue":
+        from .kq import DirectoryFollower as cls
+    elif backend == "inotify":
+        from .inotify import InotifyFollower as cls
+    else:
+        raise Exception(f"Unknown follower backend '{backend}'.")
+    return cls(path, **kwargs)
+
+__all__ = (
+    "Follower",
+    "LineReader",
+    "open_follower",
+)
@@ -0,0 +1,121 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+
+from .follow import Follower
+
+IN_MODIFY      = 0x00000002
+IN_ATTRIB      = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_ONLYDIR     = 0x01000000
+IN_IGNORED     = 0x00008000
+IN_NONBLOCK    = os.O_NONBLOCK
+IN_CLOEXEC     = os.O_CLOEXEC
+
+_EVENT = struct.Struct("iIII")
+_libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+
+def _check(res):
+    if res < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return res
+
+class Inotify:
+    def __init__(self):
+        self.fd = _check(_libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC))
+
+    def __del__(self):
+        self.close()
+
+    def fileno(self):
+        return self.fd
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def add(self, path, mask):
+        return _check(
+            _libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        )
+
+    def remove(self, wd):
+        _check(_libc.inotify_rm_watch(self.fd, wd))
+
+    def read(self):
+        events = []
+        while True:
+            try:
+                buf = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return events
+            pos = 0
+            while pos < len(buf):
+                wd,mask,cookie,length = _EVENT.unpack_from(buf, pos)
+                pos += _EVENT.size
+                name = buf[pos:pos + length].rstrip(b"\0")
+                pos += length
+                events.append((wd, mask, cookie, os.fsdecode(name)))
+
+class InotifyFollower(Follower):
+    def __init__(self, path, **kwargs):
+        super().__init__(path, **kwargs)
+        # a watch on the directory reports writes to the files in it, too
+        self._inotify = Inotify()
+        self._inotify.add(
+            self._path, IN_MODIFY | IN_CREATE | IN_MOVED_TO | IN_ONLYDIR
+        )
+        self._rfd,self._wfd = os.pipe()
+        os.set_blocking(self._rfd, False)
+        os.set_blocking(self._wfd, False)
+        self._epoll = select.epoll()
+        self._epoll.register(self._rfd, select.EPOLLIN)
+        self._epoll.register(self._inotify.fileno(), select.EPOLLIN)
+
+    def __del__(self):
+        if self._rfd is not None:
+            self._epoll.close()
+            self._inotify.close()
+            os.close(self._rfd)
+            os.close(self._wfd)
+            self._rfd = self._wfd = None
+        super().__del__()
+
+    def fileno(self):
+        return self._epoll.fileno()
+
+    def _wakeup(self):
+        try:
+            os.write(self._wfd, b"\0")
+        except BlockingIOError:
+            pass
+
+    def _poll(self, timeout):
+        changed = False
+        readable = set()
+        if not self._epoll.poll(-1 if timeout is None else timeout):
+            return (changed, readable)
+        try:
+            while os.read(self._rfd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        for _,mask,_,name in self._inotify.read():
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                changed = True
+            elif mask & IN_MODIFY and name:
+                if (fd := self._files.get(self._path / name)) is not None:
+                    readable.add(fd)
+        return (changed, readable)
+
+__all__ = (
+    "Inotify",
+    "InotifyFollower",
+)
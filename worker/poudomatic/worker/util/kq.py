@@ -1,17 +1,14 @@
 import anyio
-import codecs
 import os
-import pathlib
-import re
 import select
-import sys
-import threading
+
+from .follow import Follower, wait_readable
 
 KQ_FILTER_USER      = -11          # EVFILT_USER
 KQ_NOTE_FFNOP       = 0x00000000   # NOTE_FFNOP
 KQ_NOTE_TRIGGER     = 0x01000000   # NOTE_TRIGGER
-
-RE_LINEBREAK = re.compile(br"\r\n|\n|\r")
+KQ_NOTE_WRITE       = 0x00000002   # NOTE_WRITE
+KQ_NOTE_ATTRIB      = 0x00000008   # NOTE_ATTRIB
 
 class Future:
     def __init__(self):
@@ -26,143 +23,66 @@ class Future:
         self._result = result
         self._evt.set()
 
-class DirectoryFollower:
-    def __init__(self, path):
-        self._path = pathlib.Path(path).resolve()
-        self._pathfd = os.open(self._path, os.O_DIRECT)
-
+class DirectoryFollower(Follower):
+    def __init__(self, path, **kwargs):
+        super().__init__(path, **kwargs)
         self._kq = select.kqueue()
         self._kqfd = self._kq.fileno()
-        self._files = {}
-        self._fds = {}
-
-        self._closed = False
-        self._modify_lock = threading.Lock()
-        self._decoder = codecs.getdecoder(sys.getdefaultencoding())
-
-        with self._modify_lock:
-            self._add_user(self._kqfd)
-            self._set_events(
-                select.kevent(
-                    self._pathfd,
-                    select.KQ_FILTER_VNODE,
-                    select.KQ_EV_ADD | select.KQ_EV_CLEAR,
-                    select.KQ_NOTE_WRITE
-                )
-            )
-
-    def __del__(self):
-        os.close(self._pathfd)
-
-    def __bool__(self):
-        return not self._closed or bool(self._fds)
+        self._set_events(
+            select.kevent(
+                self._kqfd,
+                KQ_FILTER_USER,
+                select.KQ_EV_ADD | select.KQ_EV_CLEAR,
+                KQ_NOTE_FFNOP
+            ),
+            select.kevent(
+                self._pathfd,
+                select.KQ_FILTER_VNODE,
+                select.KQ_EV_ADD | select.KQ_EV_CLEAR,
+                KQ_NOTE_WRITE
+            ),
+        )
 
-    def _decode(self, b):
-        return self._decoder(b)[0]
+    def fileno(self):
+        return self._kqfd
 
     def _set_events(self, *evts):
         self._kq.control(evts, 0, 0)
 
-    def _add_user(self, fd):
+    def _wakeup(self):
         self._set_events(
             select.kevent(
-                fd,
+                self._kqfd,
                 KQ_FILTER_USER,
-                select.KQ_EV_ADD | select.KQ_EV_ONESHOT,
-                KQ_NOTE_FFNOP
+                0,
+                KQ_NOTE_TRIGGER
             )
         )
 
-    def _trigger_user(self, fd):
+    def _watch(self, fd, name):
+        # closing the file removes the event again
         self._set_events(
             select.kevent(
                 fd,
-                KQ_FILTER_USER,
-                select.KQ_EV_ENABLE,
-                KQ_NOTE_TRIGGER
+                select.KQ_FILTER_READ,
+                select.KQ_EV_ADD | select.KQ_EV_CLEAR,
+                0
             )
         )
 
-    def close(self):
-        self._trigger_user(self._kqfd)
-
-    def remove(self, filename):
-        if fd := self._files.get(filename):
-            self._trigger_user(fd)
-
-    def wait(self, timeout=None):
-        to_close = set()
-        to_add = set()
-
-        for kev in self._kq.control(None, len(self._fds) * 2 + 2, timeout):
-            fd = kev.ident
-
-            if kev.filter == KQ_FILTER_USER:
-                if fd == self._kqfd:
-                    self._closed = True
-                else:
-                    to_close.add(fd)
-
-            elif kev.filter == select.KQ_FILTER_VNODE and fd == self._pathfd:
-                for entry in os.scandir(fd):
-                    if entry.is_file(follow_symlinks=False):
-                        path = (self._path / entry.name).resolve()
-                        if path not in self._files:
-                            to_add.add(path)
-
+    def _poll(self, timeout):
+        changed = False
+        readable = set()
+        for kev in self._kq.control(None, len(self._fds) + 2, timeout):
+            if kev.filter == select.KQ_FILTER_VNODE:
+                changed = True
             elif kev.filter == select.KQ_FILTER_READ:
-                fp,filename,buf = self._fds[fd]
-                *lines,last = RE_LINEBREAK.split(fp.read())
-                if lines:
-                    yield (filename, self._decode(buf + lines.pop(0)))
-                    buf.clear()
-                if last:
-                    buf.extend(last)
-                for line in lines:
-                    yield (filename, self._decode(line))
-
-        if not to_close and not to_add:
-            return
-
-        with self._modify_lock:
-            for fd in to_close:
-                fp,filename,_ = self._fds[fd]
-                fp.close()
-                del self._files[filename]
-                del self._fds[fd]
-
-            events = []
-
-            for filename in to_add:
-                fp = filename.open(mode="rb", buffering=0)
-                fd = fp.fileno()
-                self._files[filename] = fd
-                self._fds[fd] = (fp, filename, bytearray())
-                events.extend([
-                    select.kevent(
-                        fd,
-                        KQ_FILTER_USER,
-                        select.KQ_EV_ADD | select.KQ_EV_ONESHOT,
-                        KQ_NOTE_FFNOP
-                    ),
-                    select.kevent(
-                        fd,
-                        select.KQ_FILTER_READ,
-                        select.KQ_EV_ADD | select.KQ_EV_CLEAR,
-                        0
-                    ),
-                ])
-
-            self._set_events(*events)
-
-    def __iter__(self):
-        while self:
-            for evt in self.wait():
-                yield evt
+                readable.add(kev.ident)
+        return (changed, readable)
 
 class Watcher:
-    ATTRIB = select.KQ_NOTE_ATTRIB
-    WRITE  = select.KQ_NOTE_WRITE
+    ATTRIB = KQ_NOTE_ATTRIB
+    WRITE  = KQ_NOTE_WRITE
 
     def __init__(self):
         self.kq = select.kqueue()
@@ -172,8 +92,14 @@ class Watcher:
         self.fut = None
 
     def __del__(self):
+        self.close()
+
+    def close(self):
         for fd in self.to_close:
             os.close(fd)
+        self.to_close.clear()
+        self.fds.clear()
+        self.kq.close()
 
     def add(self, fp, fflags):
         if isinstance(fp, str):
@@ -198,6 +124,27 @@ class Watcher:
         self.fds.add(fd)
         return fd
 
+    def add_user(self):
+        self.kq.control(
+            [ select.kevent(
+                self.kqfd,
+                KQ_FILTER_USER,
+                select.KQ_EV_ADD | select.KQ_EV_CLEAR,
+                KQ_NOTE_FFNOP) ],
+            0, 0
+        )
+        self.fds.add(self.kqfd)
+
+    def trigger(self):
+        self.kq.control(
+            [ select.kevent(
+                self.kqfd,
+                KQ_FILTER_USER,
+                0,
+                KQ_NOTE_TRIGGER) ],
+            0, 0
+        )
+
     def wait(self, timeout=None):
         return [
             (kev.ident, kev.fflags)
@@ -209,7 +156,7 @@ class Watcher:
             return await self.fut.result()
         else:
             self.fut = Future()
-            await anyio.wait_socket_readable(self.kqfd)
+            await wait_readable(self.kqfd)
             res = self.wait(timeout=0)
             self.fut.set(res)
             self.fut = None
@@ -0,0 +1,35 @@
+import anyio
+
+from anyio.from_thread import BlockingPortal
+from threading import Event, Lock, Thread
+
+class EventLoop:
+    def __init__(self):
+        self._lock = Lock()
+        self._portal = None
+
+    async def _main(self, started):
+        async with BlockingPortal() as portal:
+            self._portal = portal
+            started.set()
+            await portal.sleep_until_stopped()
+
+    def _start(self):
+        # the loop runs on its own thread, started on first use
+        with self._lock:
+            if self._portal is None:
+                started = Event()
+                Thread(
+                    target=anyio.run, args=(self._main, started),
+                    name="EventLoop", daemon=True,
+                ).start()
+                started.wait()
+            return self._portal
+
+    def call(self, func, *args):
+        # runs func on the loop and blocks until it returns
+        return self._start().call(func, *args)
+
+__all__ = (
+    "EventLoop",
+)
@@ -0,0 +1,175 @@
+import anyio
+import os
+import select
+import sys
+
+from time import monotonic
+
+from .kq import Future, Watcher, wait_readable
+
+class Notifier:
+    def __init__(self):
+        self._fut = None
+        self._rfd,self._wfd = os.pipe()
+        os.set_blocking(self._rfd, False)
+        os.set_blocking(self._wfd, False)
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        if self._rfd is not None:
+            os.close(self._rfd)
+            os.close(self._wfd)
+            self._rfd = self._wfd = None
+
+    def fileno(self):
+        return self._rfd
+
+    def notify(self):
+        try:
+            os.write(self._wfd, b"\0")
+        except BlockingIOError:
+            # the pipe is full, so a wake-up is pending anyway
+            pass
+
+    def _drain(self):
+        try:
+            while os.read(self._rfd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def wait(self, timeout=None):
+        readable,_,_ = select.select([self], [], [], timeout)
+        if readable:
+            self._drain()
+
+    async def _async_wait(self):
+        await wait_readable(self.fileno())
+        self._drain()
+
+    async def async_wait(self):
+        # all concurrent waiters share one wake-up
+        if self._fut is not None:
+            return await self._fut.result()
+        self._fut = fut = Future()
+        try:
+            await self._async_wait()
+        finally:
+            self._fut = None
+            fut.set(None)
+
+class LocalNotifier(Notifier):
+    def __init__(self, path=None):
+        super().__init__()
+
+class PollingNotifier(Notifier):
+    def __init__(self, path, interval=0.5):
+        super().__init__()
+        self._path = path
+        self._interval = interval
+        self._stat = self._get_stat()
+
+    def _get_stat(self):
+        try:
+            st = os.stat(self._path)
+            return (st.st_ino, st.st_size, st.st_mtime_ns)
+        except FileNotFoundError:
+            return None
+
+    def _changed(self):
+        stat,self._stat = self._stat,self._get_stat()
+        return stat != self._stat
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else monotonic() + timeout
+        while not self._changed():
+            interval = self._interval
+            if deadline is not None:
+                if (interval := min(interval, deadline - monotonic())) <= 0:
+                    return
+            readable,_,_ = select.select([self], [], [], interval)
+            if readable:
+                self._drain()
+                return
+
+    async def _async_wait(self):
+        while not self._changed():
+            with anyio.move_on_after(self._interval):
+                await wait_readable(self.fileno())
+                self._drain()
+                return
+
+class KqueueNotifier(Notifier):
+    def __init__(self, path):
+        self._fut = None
+        self._rfd = None
+        self._watcher = None
+        self._watcher = Watcher()
+        self._watcher.add(path, Watcher.WRITE)
+        self._watcher.add_user()
+
+    def close(self):
+        # there is no pipe; the kqueue and the watched file are ours
+        if self._watcher is not None:
+            self._watcher.close()
+            self._watcher = None
+
+    def fileno(self):
+        return self._watcher.kqfd
+
+    def notify(self):
+        self._watcher.trigger()
+
+    def _drain(self):
+        self._watcher.wait(timeout=0)
+
+    def wait(self, timeout=None):
+        self._watcher.wait(timeout)
+
+class InotifyNotifier(Notifier):
+    def __init__(self, path):
+        from .inotify import Inotify, IN_MODIFY
+        super().__init__()
+        self._inotify = Inotify()
+        self._inotify.add(path, IN_MODIFY)
+        self._epoll = select.epoll()
+        self._epoll.register(self._rfd, select.EPOLLIN)
+        self._epoll.register(self._inotify.fileno(), select.EPOLLIN)
+
+    def close(self):
+        if self._rfd is not None:
+            self._epoll.close()
+            self._inotify.close()
+        super().close()
+
+    def fileno(self):
+        return self._epoll.fileno()
+
+    def _drain(self):
+        super()._drain()
+        self._inotify.read()
+
+BACKENDS = {
+    "kqueue":  KqueueNotifier,
+    "inotify": InotifyNotifier,
+    "polling": PollingNotifier,
+    "local":   LocalNotifier,
+}
+
+def open_notifier(path, backend="auto"):
+    if backend == "auto":
+        if hasattr(select, "kqueue"):
+            backend = "kqueue"
+        elif sys.platform.startswith("linux"):
+            backend = "inotify"
+        else:
+            backend = "polling"
+    if backend not in BACKENDS:
+        raise Exception(f"Unknown notification backend '{backend}'.")
+    return BACKENDS[backend](path)
+
+__all__ = (
+    "open_notifier",
+)
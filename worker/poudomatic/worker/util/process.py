@@ -1,3 +1,8 @@
+import os
+
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
 from inspect import isgenerator
 from shlex import quote
 from signal import SIGINT
@@ -8,7 +13,11 @@ from subprocess import (
     STDOUT,
 )
 from sys import getdefaultencoding
-from threading import Thread
+from threading import Lock, Thread
+from time import monotonic
+
+current_profile = ContextVar("current_profile", default=None)
+current_group = ContextVar("current_group", default=None)
 
 def shquote(*args):
     return " ".join(quote(str(arg)) for arg in args)
@@ -16,20 +25,139 @@ def shquote(*args):
 class CommandError(Exception):
     pass
 
+class OutputTail:
+    def __init__(self, size):
+        self.size = size
+        self.dropped = 0
+        self._lines = deque()
+        self._length = 0
+
+    def append(self, line):
+        if len(line) > self.size:
+            line = line[-self.size:]
+        self._lines.append(line)
+        self._length += len(line)
+        while self._length > self.size:
+            self._length -= len(self._lines.popleft())
+            self.dropped += 1
+
+    def value(self, empty=""):
+        return empty.join(self._lines)
+
+class Profile:
+    def __init__(self, max_commands=1000):
+        self.max_commands = max_commands
+        self.commands = []
+        self.totals = {}
+        self._lock = Lock()
+
+    @contextmanager
+    def activate(self):
+        token = current_profile.set(self)
+        try:
+            yield self
+        finally:
+            current_profile.reset(token)
+
+    def add(self, label, argv, wall, exit, rusage):
+        record = {
+            "label": label,
+            "argv": argv,
+            "wall": wall,
+            "exit": exit,
+            "utime": rusage.ru_utime,
+            "stime": rusage.ru_stime,
+            "maxrss": rusage.ru_maxrss,
+        }
+        with self._lock:
+            if len(self.commands) < self.max_commands:
+                self.commands.append(record)
+            total = self.totals.setdefault(label, {
+                "count": 0, "wall": 0.0, "utime": 0.0, "stime": 0.0,
+                "maxrss": 0,
+            })
+            total["count"] += 1
+            for key in ("wall", "utime", "stime"):
+                total[key] += record[key]
+            total["maxrss"] = max(total["maxrss"], record["maxrss"])
+
+    def summary(self):
+        with self._lock:
+            return {
+                "totals": dict(self.totals),
+                "commands": list(self.commands),
+            }
+
+class ProcessGroup:
+    # the commands a task is running, so they can be stopped from outside
+    def __init__(self):
+        self.stopped = False
+        self._procs = set()
+        self._lock = Lock()
+
+    @contextmanager
+    def activate(self):
+        token = current_group.set(self)
+        try:
+            yield self
+        finally:
+            current_group.reset(token)
+
+    def add(self, proc):
+        with self._lock:
+            if self.stopped:
+                raise CommandError(f"{proc.args[0]} not started, stopping")
+            self._procs.add(proc)
+
+    def discard(self, proc):
+        with self._lock:
+            self._procs.discard(proc)
+
+    def stop(self):
+        with self._lock:
+            self.stopped = True
+            procs = list(self._procs)
+        for proc in procs:
+            proc.send_stop()
+
 class process:
-    def __init__(self, executable, *args, exit_ok=(0,), stop_signal=SIGINT):
+    def __init__(self, executable, *args, exit_ok=(0,), stop_signal=SIGINT,
+                 text=True, capture=1 << 20, label=None):
         self.args = (executable,) + args
+        self.label = label or os.path.basename(str(executable))
+        # commands started on the runner report to the creating task
+        self.profile = current_profile.get()
+        self.group = current_group.get()
+        self.started = None
         self.exit_ok = exit_ok
         self.stop_signal = stop_signal
+        self.text = text
         self.stdin = None
         self.proc = None
+        # only the end of the output is kept for run() and CommandError
+        self.output = OutputTail(capture)
 
     def __lshift__(self, items):
+        # stdin is only consumed while it is written to the process
         if self.stdin is None:
-            self.stdin = ""
-        if isinstance(items, str):
-            self.stdin += items
-        else:
+            self.stdin = []
+        self.stdin.append(items)
+        return self
+
+    def __rshift__(self, func):
+        with self:
+            for line in self:
+                func(line.rstrip())
+
+    @property
+    def _empty(self):
+        return "" if self.text else b""
+
+    def _iter_stdin(self):
+        for items in self.stdin:
+            if isinstance(items, (str, bytes)):
+                yield items
+                continue
             try:
                 items = iter(items)
             except TypeError:
@@ -38,50 +166,105 @@ class process:
                 if not isgenerator(item):
                     item = (item,)
                 for line in item:
-                    self.stdin += f"{line}\n"
-        return self
-
-    def __rshift__(self, func):
-        with self:
-            for line in self:
-                func(line.rstrip())
+                    if self.text:
+                        yield f"{line}\n"
+                    else:
+                        yield line
+                        yield b"\n"
 
     def _write_stdin(self):
-        with self.proc.stdin as fp:
-            fp.write(self.stdin)
+        try:
+            with self.proc.stdin as fp:
+                for chunk in self._iter_stdin():
+                    fp.write(chunk)
+        except BrokenPipeError:
+            pass
+
+    def _popen(self):
+        if self.group is not None:
+            self.group.add(self)
+        self.started = monotonic()
+        try:
+            self.proc = Popen(
+                self.args,
+                stdin=DEVNULL if self.stdin is None else PIPE,
+                stdout=PIPE, stderr=STDOUT,
+                encoding=getdefaultencoding() if self.text else None,
+            )
+        except:
+            if self.group is not None:
+                self.group.discard(self)
+            raise
 
     def __enter__(self):
-        self.proc = Popen(
-            self.args,
-            stdin=DEVNULL if self.stdin is None else PIPE,
-            stdout=PIPE, stderr=STDOUT,
-            encoding=getdefaultencoding()
-        )
+        self._popen()
         if self.stdin is not None:
-            Thread(target=self._write_stdin).start()
+            Thread(target=self._write_stdin, daemon=True).start()
         return self
 
+    def _reaped(self, status, rusage):
+        self.proc.returncode = os.waitstatus_to_exitcode(status)
+        if self.group is not None:
+            self.group.discard(self)
+        if self.profile is not None:
+            self.profile.add(
+                self.label, [ str(arg) for arg in self.args ],
+                monotonic() - self.started, self.proc.returncode, rusage,
+            )
+        return self.proc.returncode
+
+    def poll(self):
+        # reap the child ourselves; Popen doesn't expose its rusage
+        if self.proc.returncode is not None:
+            return self.proc.returncode
+        pid,status,rusage = os.wait4(self.proc.pid, os.WNOHANG)
+        if pid == 0:
+            return None
+        return self._reaped(status, rusage)
+
+    def wait(self):
+        if self.proc.returncode is not None:
+            return self.proc.returncode
+        _,status,rusage = os.wait4(self.proc.pid, 0)
+        return self._reaped(status, rusage)
+
     def __exit__(self, ex_type, ex_value, ex_tb):
-        ret = self.proc.wait()
+        ret = self.wait()
         if ex_type is not KeyboardInterrupt and ret not in self.exit_ok:
-            raise CommandError()
+            raise CommandError(self.output.value(self._empty))
 
     def __iter__(self):
         try:
             for line in iter(self.proc.stdout):
+                self.output.append(line)
                 yield line
         except KeyboardInterrupt:
             self.send_stop()
             raise
 
     def send_stop(self):
-        self.proc.send_signal(self.stop_signal)
+        # Popen.send_signal() would poll and reap the child behind our back
+        if self.proc is not None and self.proc.returncode is None:
+            try:
+                os.kill(self.proc.pid, self.stop_signal)
+            except ProcessLookupError:
+                pass
 
-    def run(self):
-        output = None
-        try:
+    def run(self, full=False):
+        # only callers parsing the output ask for all of it; the others
+        # never hold more than the capture size
+        if full:
+            lines = []
             with self:
-                output = "".join(self)
-                return output
-        except CommandError:
-            raise CommandError(output)
+                lines.extend(self)
+            return self._empty.join(lines)
+
+        with self:
+            for _ in self:
+                pass
+        if self.output.dropped:
+            raise CommandError(
+                f"{self.args[0]} wrote more than {self.output.size} "
+                f"characters of output\n" + self.output.value(self._empty)
+            )
+        return self.output.value(self._empty)
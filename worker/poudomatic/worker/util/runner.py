@@ -0,0 +1,271 @@
+import codecs
+import os
+import selectors
+
+from logging import getLogger
+from sys import getdefaultencoding
+from threading import Event, Lock, Thread
+from time import monotonic
+
+from .follow import RE_LINEBREAK
+from .process import CommandError
+
+log = getLogger("runner")
+
+class Job:
+    def __init__(self, proc, on_line=None, on_exit=None, timeout=None):
+        self.proc = proc
+        self.on_line = on_line
+        self.on_exit = on_exit
+        self.deadline = None if timeout is None else monotonic() + timeout
+        self.returncode = None
+        self.timed_out = False
+        self.cancelled = False
+        self.error = None
+        self._done = Event()
+        self._buf = bytearray()
+        self._stdin = None
+        self._pending = b""
+        self._decoder = (
+            codecs.getincrementaldecoder(getdefaultencoding())("replace")
+            if proc.text else None
+        )
+
+    def _line(self, line):
+        if self._decoder is not None:
+            line = self._decoder.decode(line)
+        self.proc.output.append(line)
+        if self.on_line is not None:
+            try:
+                self.on_line(line.rstrip())
+            except Exception:
+                log.exception(f"Line callback of {self.proc.args[0]} failed.")
+
+    def _feed(self, data):
+        *lines,last = RE_LINEBREAK.split(data)
+        if lines:
+            self._buf.extend(lines.pop(0))
+            self._line(bytes(self._buf) + b"\n")
+            self._buf.clear()
+        for line in lines:
+            self._line(line + b"\n")
+        self._buf.extend(last)
+
+    def _finish(self, returncode):
+        if self._buf:
+            self._line(bytes(self._buf))
+            self._buf.clear()
+        self.returncode = returncode
+        self._done.set()
+        if self.on_exit is not None:
+            try:
+                self.on_exit(self)
+            except Exception:
+                log.exception(f"Exit callback of {self.proc.args[0]} failed.")
+
+    def done(self):
+        return self._done.is_set()
+
+    def cancel(self):
+        # jobs the runner hasn't spawned yet are dropped when it gets to them
+        if not self.done():
+            self.cancelled = True
+            self.proc.send_stop()
+
+    def wait(self, timeout=None):
+        if not self._done.wait(timeout):
+            return None
+        if self.error is not None:
+            raise CommandError(
+                f"{self.proc.args[0]} failed: {self.error}\n" +
+                self.proc.output.value(self.proc._empty)
+            )
+        if self.timed_out:
+            raise CommandError(
+                f"{self.proc.args[0]} timed out\n" +
+                self.proc.output.value(self.proc._empty)
+            )
+        if not self.cancelled and self.returncode not in self.proc.exit_ok:
+            raise CommandError(self.proc.output.value(self.proc._empty))
+        return self.returncode
+
+class Runner:
+    def __init__(self):
+        self._sel = selectors.DefaultSelector()
+        self._lock = Lock()
+        self._new = []
+        self._jobs = set()
+        self._reaping = set()
+        self._wakeup_r,self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        os.set_blocking(self._wakeup_w, False)
+        self._sel.register(self._wakeup_r, selectors.EVENT_READ)
+        self._thread = None
+
+    def start(self, proc, on_line=None, on_exit=None, timeout=None):
+        job = Job(proc, on_line, on_exit, timeout)
+        with self._lock:
+            self._new.append(job)
+            if self._thread is None:
+                self._thread = Thread(
+                    target=self._run, name="Runner", daemon=True
+                )
+                self._thread.start()
+        self._wakeup()
+        return job
+
+    def _wakeup(self):
+        try:
+            os.write(self._wakeup_w, b"\0")
+        except BlockingIOError:
+            pass
+
+    def _spawn(self, job):
+        proc = job.proc
+        if job.cancelled:
+            job._finish(None)
+            return
+        try:
+            proc._popen()
+        except (OSError, CommandError) as e:
+            proc.output.append(f"{e}\n" if proc.text else f"{e}\n".encode())
+            job._finish(-1)
+            return
+        if job.cancelled:
+            # cancelled while starting up
+            proc.send_stop()
+
+        stdout = proc.proc.stdout.fileno()
+        os.set_blocking(stdout, False)
+        self._sel.register(stdout, selectors.EVENT_READ, (job, "stdout"))
+
+        if proc.stdin is not None:
+            stdin = proc.proc.stdin.fileno()
+            os.set_blocking(stdin, False)
+            job._stdin = proc._iter_stdin()
+            self._sel.register(stdin, selectors.EVENT_WRITE, (job, "stdin"))
+
+        self._jobs.add(job)
+
+    def _write(self, job, fd):
+        try:
+            while True:
+                if not job._pending:
+                    chunk = next(job._stdin, None)
+                    if chunk is None:
+                        break
+                    job._pending = (
+                        chunk.encode(getdefaultencoding())
+                        if isinstance(chunk, str) else chunk
+                    )
+                written = os.write(fd, job._pending)
+                job._pending = job._pending[written:]
+        except BlockingIOError:
+            return
+        except BrokenPipeError:
+            pass
+        self._sel.unregister(fd)
+        job.proc.proc.stdin.close()
+
+    def _read(self, job, fd):
+        try:
+            data = os.read(fd, 65536)
+        except BlockingIOError:
+            return
+        if data:
+            job._feed(data)
+            return
+        self._sel.unregister(fd)
+        job.proc.proc.stdout.close()
+        self._reaping.add(job)
+
+    def _close(self, job):
+        for fp in (job.proc.proc.stdout, job.proc.proc.stdin):
+            if fp is not None and not fp.closed:
+                if fp.fileno() in self._sel.get_map():
+                    self._sel.unregister(fp.fileno())
+                fp.close()
+
+    def _fail(self, job, error):
+        # only this job is affected; the runner carries on with the others
+        log.exception(f"Running {job.proc.args[0]} failed.")
+        job.error = error
+        self._reaping.discard(job)
+        self._jobs.discard(job)
+        if job.proc.proc is not None:
+            try:
+                self._close(job)
+                if job.proc.proc.returncode is None:
+                    # stopped and reaped like any other job, but failed
+                    job.proc.send_stop()
+                    self._jobs.add(job)
+                    self._reaping.add(job)
+                    return
+            except Exception:
+                log.exception(f"Cleaning up {job.proc.args[0]} failed.")
+        job._finish(-1)
+
+    def _reap(self):
+        for job in list(self._reaping):
+            try:
+                if (ret := job.proc.poll()) is None:
+                    continue
+                self._reaping.discard(job)
+                self._jobs.discard(job)
+                self._close(job)
+                job._finish(ret)
+            except Exception as e:
+                log.exception(f"Reaping {job.proc.args[0]} failed.")
+                self._reaping.discard(job)
+                self._jobs.discard(job)
+                job.error = e
+                job._finish(-1)
+
+    def _timeout(self):
+        # reaping children that closed their output needs polling
+        timeout = 0.05 if self._reaping else None
+        now = monotonic()
+        for job in self._jobs:
+            if job.deadline is None or job.timed_out:
+                continue
+            if job.deadline <= now:
+                job.timed_out = True
+                job.proc.send_stop()
+            else:
+                left = job.deadline - now
+                timeout = left if timeout is None else min(timeout, left)
+        return timeout
+
+    def _run(self):
+        while True:
+            with self._lock:
+                new,self._new = self._new,[]
+            for job in new:
+                try:
+                    self._spawn(job)
+                except Exception as e:
+                    self._fail(job, e)
+
+            for key,_ in self._sel.select(self._timeout()):
+                if key.fd == self._wakeup_r:
+                    while True:
+                        try:
+                            os.read(self._wakeup_r, 4096)
+                        except BlockingIOError:
+                            break
+                    continue
+                job,stream = key.data
+                try:
+                    if stream == "stdout":
+                        self._read(job, key.fd)
+                    else:
+                        self._write(job, key.fd)
+                except Exception as e:
+                    self._fail(job, e)
+
+            self._reap()
+
+__all__ = (
+    "Job",
+    "Runner",
+)
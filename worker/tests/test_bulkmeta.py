@@ -0,0 +1,139 @@
+import os
+import random
+
+import pytest
+
+from poudomatic.worker.bulkmeta import BulkMeta
+
+ALL_PKGS = ".poudriere.all_pkgs%"
+PKG_DEPS = ".poudriere.pkg_deps%"
+
+def append(path, data):
+    with open(path, "ab") as fp:
+        fp.write(data)
+
+def rewrite(path, data):
+    # a new file in place of the old one, like poudriere starting over
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+def as_dicts(pkgdeps):
+    return (
+        dict(pkgdeps.pkgmap),
+        { origin: set(deps) for origin,deps in pkgdeps.depends.items() },
+    )
+
+def reparsed(base):
+    return as_dicts(BulkMeta(base).read_pkg_deps())
+
+def test_appended_in_pieces(tmp_path):
+    rnd = random.Random(22)
+    pkgs = [ (f"p{i}-1.0", f"cat/p{i}") for i in range(200) ]
+    edges = [
+        (pkgs[i][0], pkgs[j][0])
+        for i in range(1, len(pkgs))
+        for j in rnd.sample(range(i), min(i, 3))
+    ]
+    # some refer to packages all_pkgs never lists
+    edges += [ (pkgs[i][0], "gone-1") for i in range(0, len(pkgs), 20) ]
+    rnd.shuffle(edges)
+    rnd.shuffle(pkgs)
+    files = {
+        tmp_path / ALL_PKGS:
+            b"".join(f"{pkg} {origin} x\n".encode() for pkg,origin in pkgs),
+        tmp_path / PKG_DEPS:
+            b"".join(f"{pkg} {dep}\n".encode() for pkg,dep in edges),
+    }
+
+    meta = BulkMeta(tmp_path)
+    meta.read_pkg_deps()
+    written = dict.fromkeys(files, 0)
+    while any(written[path] < len(data) for path,data in files.items()):
+        # the edges often get ahead of the packages they refer to
+        path = rnd.choice(list(files))
+        pos = written[path]
+        size = rnd.randrange(1, 400)
+        append(path, files[path][pos:pos + size])
+        written[path] = pos + size
+        assert as_dicts(meta.read_pkg_deps()) == reparsed(tmp_path)
+
+    pkgmap,depends = as_dicts(meta.read_pkg_deps())
+    assert len(pkgmap) == 200
+    assert sum(len(deps) for deps in depends.values()) == len(edges) - 10
+
+def test_unresolved_edges(tmp_path):
+    meta = BulkMeta(tmp_path)
+    append(tmp_path / ALL_PKGS, b"a-1 cat/a\n")
+    append(tmp_path / PKG_DEPS, b"a-1 b-1\na-1 c-1\n")
+    assert as_dicts(meta.read_pkg_deps()) == ({ "a-1": "cat/a" }, {})
+
+    append(tmp_path / ALL_PKGS, b"b-1 cat/b\n")
+    assert as_dicts(meta.read_pkg_deps())[1] == { "cat/a": {"cat/b"} }
+    append(tmp_path / ALL_PKGS, b"c-1 cat/c\n")
+    assert as_dicts(meta.read_pkg_deps())[1] == {
+        "cat/a": {"cat/b", "cat/c"},
+    }
+
+    # an edge that never resolves doesn't hold up the ones after it
+    append(tmp_path / PKG_DEPS, b"b-1 x-1\nb-1 c-1\n")
+    assert as_dicts(meta.read_pkg_deps())[1] == {
+        "cat/a": {"cat/b", "cat/c"}, "cat/b": {"cat/c"},
+    }
+    assert reparsed(tmp_path)[1] == as_dicts(meta.read_pkg_deps())[1]
+
+def test_restarted_files(tmp_path):
+    all_pkgs = tmp_path / ALL_PKGS
+    pkg_deps = tmp_path / PKG_DEPS
+    meta = BulkMeta(tmp_path)
+    append(all_pkgs, b"a-1 cat/a\nb-1 cat/b\n")
+    append(pkg_deps, b"a-1 b-1\n")
+    meta.read_pkg_deps()
+
+    # replaced by another file
+    rewrite(all_pkgs, b"c-1 cat/c\nb-1 cat/b\n")
+    rewrite(pkg_deps, b"c-1 b-1\n")
+    assert as_dicts(meta.read_pkg_deps()) == reparsed(tmp_path) == (
+        { "c-1": "cat/c", "b-1": "cat/b" }, { "cat/c": {"cat/b"} },
+    )
+
+    # truncated and written again
+    all_pkgs.write_bytes(b"d-1 cat/d\n")
+    pkg_deps.write_bytes(b"")
+    assert as_dicts(meta.read_pkg_deps()) == ({ "d-1": "cat/d" }, {})
+
+    # rewritten in place to the same size
+    all_pkgs.write_bytes(b"e-1 cat/e\n")
+    st = all_pkgs.stat()
+    os.utime(all_pkgs, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+    assert as_dicts(meta.read_pkg_deps()) == ({ "e-1": "cat/e" }, {})
+
+    # removed
+    all_pkgs.unlink()
+    pkg_deps.unlink()
+    assert as_dicts(meta.read_pkg_deps()) == ({}, {})
+
+def test_read_only(tmp_path):
+    append(tmp_path / ALL_PKGS, b"a-1 cat/a\nb-1 cat/b\n")
+    append(tmp_path / PKG_DEPS, b"a-1 b-1\n")
+    pkgdeps = BulkMeta(tmp_path).read_pkg_deps()
+    with pytest.raises(TypeError):
+        pkgdeps.pkgmap["c-1"] = "cat/c"
+    with pytest.raises(TypeError):
+        pkgdeps.depends["cat/c"] = frozenset()
+    with pytest.raises(AttributeError):
+        pkgdeps.depends["cat/a"].add("cat/c")
+
+def test_bulk_stats(tmp_path):
+    meta = BulkMeta(tmp_path)
+    append(tmp_path / ".poudriere.ports.queued", b"cat/a a-1 x\ncat/b b")
+    append(tmp_path / ".poudriere.ports.built", b"cat/a a-1 x\n")
+    stats = meta.read_bulk_stats()
+    assert stats.built == {"a-1"}
+    assert dict(stats.queued) == { "cat/a": "a-1" }
+
+    append(tmp_path / ".poudriere.ports.queued", b"-1 x\n")
+    append(tmp_path / ".poudriere.ports.built", b"cat/b b-1 x\n")
+    stats = meta.read_bulk_stats()
+    assert stats.built == {"a-1", "b-1"}
+    assert dict(stats.queued) == { "cat/a": "a-1", "cat/b": "b-1" }
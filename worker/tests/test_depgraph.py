@@ -0,0 +1,77 @@
+import pytest
+
+from poudomatic.worker.depgraph import CycleError, DepGraph
+
+# d depends on b and c, which both depend on a
+DEPENDS = {
+    "x/d": ["x/b", "x/c"],
+    "x/b": ["x/a"],
+    "x/c": ["x/a"],
+}
+
+@pytest.fixture
+def graph():
+    return DepGraph.from_depends(DEPENDS)
+
+def test_nodes(graph):
+    assert len(graph) == 4
+    assert "x/a" in graph
+    assert "x/e" not in graph
+
+def test_duplicate_and_self_edges():
+    graph = DepGraph.from_depends({ "x/b": ["x/a", "x/a", "x/b"] })
+    assert graph.to_depends() == { "x/b": ["x/a"] }
+
+def test_topological(graph):
+    order = graph.topological()
+    assert sorted(order) == ["x/a", "x/b", "x/c", "x/d"]
+    for origin,deps in DEPENDS.items():
+        for dep in deps:
+            assert order.index(dep) < order.index(origin)
+
+def test_order_follows_changes(graph):
+    graph.topological()
+    graph.add_edges([(graph.node("x/a"), graph.node("x/e"))])
+    assert graph.topological()[0] == "x/e"
+    assert graph.rebuild_set("x/e")[:2] == ["x/e", "x/a"]
+
+def test_levels(graph):
+    assert [ sorted(level) for level in graph.levels() ] == [
+        ["x/a"], ["x/b", "x/c"], ["x/d"],
+    ]
+    assert DepGraph().levels() == []
+
+def test_cycle():
+    graph = DepGraph.from_depends({
+        "x/a": ["x/b"], "x/b": ["x/c"], "x/c": ["x/a"], "x/d": ["x/a"],
+    })
+    with pytest.raises(CycleError, match="x/a, x/b, x/c, x/d"):
+        graph.topological()
+
+def test_critical_path(graph):
+    assert graph.critical_path() == (3, ["x/a", "x/b", "x/d"])
+    assert graph.critical_path({ "x/a": 10, "x/c": 5 }) == (
+        16, ["x/a", "x/c", "x/d"]
+    )
+    assert graph.critical_path({ "x/a": 10 }, default=0) == (
+        10, ["x/a", "x/b", "x/d"]
+    )
+    assert DepGraph().critical_path() == (0, [])
+
+def test_closures(graph):
+    assert graph.dependencies("x/d") == {"x/a", "x/b", "x/c"}
+    assert graph.dependencies("x/b", "x/c") == {"x/a"}
+    assert graph.dependents("x/a") == {"x/b", "x/c", "x/d"}
+    assert graph.dependents("x/d") == set()
+    assert graph.dependents("x/e") == set()
+
+def test_rebuild_set(graph):
+    assert graph.rebuild_set("x/d") == ["x/d"]
+    assert graph.rebuild_set("x/b") == ["x/b", "x/d"]
+    rebuild = graph.rebuild_set("x/a")
+    assert rebuild[0] == "x/a" and rebuild[-1] == "x/d"
+    assert sorted(rebuild[1:3]) == ["x/b", "x/c"]
+
+def test_to_depends(graph):
+    assert graph.to_depends() == DEPENDS
+    assert DepGraph.from_depends(graph.to_depends()).to_depends() == DEPENDS
@@ -0,0 +1,69 @@
+import random
+
+import pytest
+
+from poudomatic.worker.util.follow import LineReader, RE_LINEBREAK
+
+BUFSIZE = 8
+
+@pytest.fixture
+def file(tmp_path):
+    path = tmp_path / "log"
+    with open(path, "wb", buffering=0) as writer, \
+         open(path, "rb", buffering=0) as reader:
+        yield writer, LineReader(reader, BUFSIZE)
+
+def cut(line):
+    # overlong lines come in pieces of the buffer size
+    pieces = [ line[i:i + BUFSIZE] for i in range(0, len(line), BUFSIZE) ]
+    if line and len(line) % BUFSIZE == 0:
+        pieces.append(b"")
+    return pieces or [b""]
+
+def test_line_breaks(file):
+    writer,reader = file
+    for data,lines in (
+            (b"ab\r", []),
+            (b"\ncd\n", [b"ab", b"cd"]),
+            (b"ef\rgh", [b"ef"]),
+            (b"\r\n\n", [b"gh", b""]),
+            # a CR exactly at the end of the buffer
+            (b"abcdefg\r", [b"abcdefg"]),
+            (b"\nxy\r", []),
+            (b"z\n", [b"xy", b"z"]),
+            (b"0123456789abcdefghij\n", [b"01234567", b"89abcdef", b"ghij"]),
+        ):
+        writer.write(data)
+        assert reader.read(1 << 20) == (lines, False)
+
+def test_limit(file):
+    writer,reader = file
+    writer.write(b"a\nb\nc\nd\ne\nf\n")
+    assert reader.read(4) == ([b"a", b"b", b"c", b"d"], True)
+    # hitting the limit always reports more data
+    assert reader.read(4) == ([b"e", b"f"], True)
+    assert reader.read(4) == ([], False)
+
+def test_appended_in_pieces(file):
+    writer,reader = file
+    rnd = random.Random(19)
+    data = b"".join(
+        b"x" * rnd.randrange(20) + rnd.choice((b"\n", b"\r\n", b"\r"))
+        for _ in range(500)
+    ) + b"\n"
+
+    lines = []
+    pos = 0
+    while pos < len(data):
+        size = rnd.randrange(1, 12)
+        writer.write(data[pos:pos + size])
+        pos += size
+        more = True
+        while more:
+            read,more = reader.read(rnd.randrange(1, 32))
+            lines.extend(read)
+
+    expected = [
+        piece for line in RE_LINEBREAK.split(data)[:-1] for piece in cut(line)
+    ]
+    assert lines == expected
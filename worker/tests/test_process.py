@@ -0,0 +1,37 @@
+import pytest
+
+from poudomatic.worker.util import process, CommandError
+
+def test_run():
+    assert process("echo", "hello").run() == "hello\n"
+    assert process("echo", "hello", text=False).run() == b"hello\n"
+
+def test_run_fails():
+    with pytest.raises(CommandError, match="oops"):
+        process("sh", "-c", "echo oops; exit 3").run()
+    assert process("sh", "-c", "exit 3", exit_ok=(3,)).run() == ""
+
+def test_run_truncated():
+    # the output doesn't fit into what is kept; it's not silently cut
+    proc = process("seq", "1000", capture=100)
+    with pytest.raises(CommandError, match="more than 100 characters"):
+        proc.run()
+    assert len(proc.output.value()) <= 100
+
+def test_run_full():
+    output = process("seq", "1000", capture=100).run(full=True)
+    assert output.split() == [ str(i) for i in range(1, 1001) ]
+
+def test_stdin():
+    lines = ( f"line {i}" for i in range(3) )
+    proc = process("cat") << "first\n" << lines << [ (c for c in "ab") ]
+    assert proc.run() == "first\nline 0\nline 1\nline 2\na\nb\n"
+
+def test_stdin_bytes():
+    proc = process("cat", text=False) << [b"x", b"y"]
+    assert proc.run() == b"x\ny\n"
+
+def test_stream():
+    lines = []
+    process("printf", "a\\nb\\n") >> lines.append
+    assert lines == ["a", "b"]
@@ -0,0 +1,147 @@
+import pytest
+
+from poudomatic.worker.depgraph import DepGraph
+from poudomatic.worker.progress import BulkProgress, parse_duration
+
+@pytest.fixture
+def events():
+    return []
+
+@pytest.fixture
+def progress(events):
+    return BulkProgress(events.append)
+
+def of_kind(events, kind):
+    return [ event for event in events if event["event"] == kind ]
+
+def test_parse_duration():
+    assert parse_duration("00:00:07") == 7
+    assert parse_duration("01:02:03") == 3723
+    assert parse_duration("02:03") == 123
+
+def test_builders(progress, events):
+    progress.bulk_line("[00:00:12] Building 5 packages using up to 6 builders")
+    assert progress.counts["queued"] == 5
+    assert progress.builders == 6
+    event, = events
+    assert event["type"] == "event"
+    assert event["event"] == "progress"
+    assert event["queued"] == 5 and event["builders"] == 6
+
+def test_start_and_finish(progress, events):
+    progress.bulk_line(
+        "[00:00:13] [01] [00:00:00] Building ports-mgmt/pkg | pkg-1.19.1"
+    )
+    assert progress.busy == { 1: "ports-mgmt/pkg" }
+    assert events == [{
+        "type": "event", "event": "start", "port": "ports-mgmt/pkg",
+        "builder": 1, "expected": None,
+    }]
+
+    progress.bulk_line(
+        "[00:01:37] [01] [00:01:24] Finished ports-mgmt/pkg | pkg-1.19.1: "
+        "Success"
+    )
+    assert progress.busy == {}
+    assert progress.counts["built"] == 1
+    finish, = of_kind(events, "finish")
+    assert finish == {
+        "type": "event", "event": "finish", "port": "ports-mgmt/pkg",
+        "builder": 1, "pkg": "pkg-1.19.1", "result": "success",
+        "duration": 84,
+    }
+    assert events[-1]["event"] == "progress"
+    assert events[-1]["built"] == 1
+
+def test_failed(progress, events):
+    progress.bulk_line(
+        "[00:00:40] [02] [00:00:30] Finished www/foo | foo-1.0: Failed: build"
+    )
+    assert progress.counts["failed"] == 1
+    finish, = of_kind(events, "finish")
+    assert finish["result"] == "failed"
+    assert finish["duration"] == 30
+
+def test_finish_reported_once(progress, events):
+    line = "[00:00:40] [02] [00:00:30] Finished www/foo | foo-1.0: Success"
+    progress.bulk_line(line)
+    progress.bulk_line(line)
+    assert len(of_kind(events, "finish")) == 1
+    assert progress.counts["built"] == 1
+
+def test_port_log(progress, events):
+    # the port's own log is seen before the bulk output reports it
+    progress.port_log("www/foo")
+    progress.port_log("www/foo", "build time: 00:02:00")
+    progress.bulk_line(
+        "[00:00:01] [03] [00:00:00] Building www/foo | foo-1.0"
+    )
+    assert len(of_kind(events, "start")) == 1
+    assert of_kind(events, "start")[0]["builder"] is None
+
+    # the build time from the log wins over the bulk output's
+    progress.bulk_line(
+        "[00:02:05] [03] [00:02:04] Finished www/foo | foo-1.0: Success"
+    )
+    assert of_kind(events, "finish")[0]["duration"] == 120
+
+def test_stats(progress, events):
+    progress.bulk_line(
+        "[00:00:13] Queued: 5 Built: 2 Failed: 1 Skipped: 1 Ignored: 0 "
+        "Fetched: 0 Tobuild: 1  Time: 00:00:13"
+    )
+    assert progress.counts == {
+        "queued": 5, "built": 2, "failed": 1, "skipped": 1, "ignored": 0,
+    }
+    assert events[-1]["event"] == "progress"
+
+def test_other_lines(progress, events):
+    progress.bulk_line("[00:00:01] Cleaning the build queue")
+    assert events == []
+
+def test_eta(events):
+    progress = BulkProgress(events.append, { "x/a": 100, "x/b": 10 })
+    assert progress.eta() == 0
+
+    progress.bulk_line("[00:00:01] Building 3 packages using 4 builders")
+    # without a plan every port is expected to take the mean
+    assert progress.eta() == round(3 * 55 / 4)
+
+    progress = BulkProgress(events.append)
+    progress.bulk_line("[00:00:01] Building 2 packages using 4 builders")
+    assert progress.eta() is None
+
+def test_plan(events):
+    progress = BulkProgress(events.append, { "x/a": 100, "x/b": 10 })
+    progress.bulk_line("[00:00:01] Building 2 packages using 4 builders")
+    progress.plan(DepGraph.from_depends({ "x/b": ["x/a"] }), ["x/a", "x/b"])
+    plan, = of_kind(events, "plan")
+    assert plan["ports"] == 2
+    assert plan["critical_path"] == ["x/a", "x/b"]
+    assert plan["critical_time"] == 110
+    # the dependency chain takes longer than the ports in parallel
+    assert events[-1]["eta"] == 110
+
+def test_eta_while_building(events):
+    progress = BulkProgress(events.append, { "x/a": 100, "x/b": 10 })
+    progress.CRITICAL_INTERVAL = 0
+    progress.bulk_line("[00:00:01] Building 3 packages using 4 builders")
+    progress.plan(
+        DepGraph.from_depends({ "x/b": ["x/a"], "x/c": ["x/a"] }),
+        ["x/a", "x/b", "x/c"],
+    )
+    # x/c has no estimate and counts with the mean
+    assert progress.waiting == {"x/a", "x/b", "x/c"}
+    assert progress.eta() == 155
+
+    progress.bulk_line(
+        "[00:00:02] [01] [00:00:00] Building x/a | a-1"
+    )
+    assert progress.waiting == {"x/b", "x/c"}
+    assert 150 <= progress.eta() <= 155
+
+    progress.bulk_line(
+        "[00:00:42] [01] [00:00:40] Finished x/a | a-1: Success"
+    )
+    # the mean now comes from the actual build times
+    assert progress.eta() == 40
@@ -0,0 +1,66 @@
+import logging
+import time
+
+import pytest
+
+from poudomatic.worker.scheduler import Scheduler
+from poudomatic.worker.storage import Storage
+
+class Task:
+    def __init__(self, locks=None):
+        self._locks = locks or {}
+
+    def locks(self):
+        return self._locks
+
+    def run(self, env, task_id):
+        return task_id
+
+def wait_idle(sched):
+    # leaving the scheduler stops the tasks still running
+    deadline = time.monotonic() + 10
+    while sched.leased() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+@pytest.fixture
+def stor(tmp_path):
+    with Storage(str(tmp_path / "tasks.sqlite"), worker_id="w1") as stor:
+        yield stor
+
+def test_run(stor):
+    stor.enqueue("t1", Task())
+    with Scheduler(None, stor) as sched:
+        assert sched.start_next()
+        assert not sched.start_next()
+        wait_idle(sched)
+    assert stor.get_result("t1") == (
+        3, { "status": "success", "detail": "t1" }
+    )
+    assert sched.leased() == []
+
+def test_locks(stor):
+    stor.enqueue("t1", Task({ ("jail", "a"): True }))
+    stor.enqueue("t2", Task({ ("jail", "a"): False }))
+    stor.enqueue("t3", Task({ ("jail", "b"): False }))
+    sched = Scheduler(None, stor, slots=3)
+    selected = stor.claim_next(sched._select)
+    assert selected[0] == "t1"
+    # t3 may overtake t2, which waits for the exclusive lock of t1
+    assert stor.claim_next(sched._select)[0] == "t3"
+    assert stor.claim_next(sched._select) is None
+
+def test_end_task_fails(stor, monkeypatch, caplog):
+    def end_task(*args):
+        raise Exception("database is locked")
+    monkeypatch.setattr(stor, "end_task", end_task)
+
+    stor.enqueue("t1", Task())
+    with caplog.at_level(logging.ERROR, "scheduler"):
+        with Scheduler(None, stor) as sched:
+            sched.start_next()
+            wait_idle(sched)
+
+    assert "Ending task t1 failed" in caplog.text
+    # the lease isn't renewed anymore, so another worker takes over
+    assert sched.leased() == []
+    assert stor.get_result("t1")[0] == 2
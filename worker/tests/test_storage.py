@@ -0,0 +1,270 @@
+import json
+import pickle
+import sqlite3
+
+import pytest
+
+from poudomatic.worker.storage import Storage, percentile
+
+class Task:
+    def __init__(self, name, group=None):
+        self.names = [name]
+        self.group = group
+
+    def coalesce(self, other):
+        if self.group is not None and other.group == self.group:
+            merged = Task(self.names[0], self.group)
+            merged.names = self.names + other.names
+            return merged
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "tasks.sqlite")
+
+@pytest.fixture
+def stor(path):
+    with Storage(path, worker_id="w1") as stor:
+        yield stor
+
+def user_version(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
+
+def test_percentile():
+    assert percentile([5], 50) == 5
+    assert percentile([1, 2, 3, 4], 0) == 1
+    assert percentile([1, 2, 3, 4], 50) == 2.5
+    assert percentile([1, 2, 3, 4], 100) == 4
+    assert percentile(list(range(1, 11)), 90) == pytest.approx(9.1)
+
+def test_migrate_from_initial_schema(path):
+    # a database as written before any of the upgrades
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.executescript(Storage.schema)
+    conn.execute(
+        "INSERT INTO tasks (tid,data,status,result) VALUES (?,?,3,?)",
+        ("t1", pickle.dumps(Task("a")), pickle.dumps({"pkg": "a/a"}))
+    )
+    conn.execute(
+        "INSERT INTO tasks (tid,data,status) VALUES (?,?,2)",
+        ("t2", pickle.dumps(Task("b")))
+    )
+    conn.executemany("INSERT INTO log (rowid,tid,data) VALUES (?,?,?)", [
+        (1, "t1", pickle.dumps({"type": "log", "msg": "hello world",
+                                "origin": "a/a"})),
+        (2, "t1", None),
+        (5, "t2", pickle.dumps({"type": "log", "msg": "building"})),
+    ])
+    conn.close()
+
+    with Storage(path, worker_id="w1") as stor:
+        assert user_version(path) == Storage.VERSION
+        assert stor._sql("PRAGMA auto_vacuum", results=1) == (2,)
+        assert stor.get_result("t1") == (3, {"pkg": "a/a"})
+
+        complete,entries = stor._get_log_sync("t1")
+        assert complete
+        assert [ (rowid, json.loads(data)) for rowid,data in entries ] == [
+            (1, {"type": "log", "msg": "hello world", "origin": "a/a"}),
+        ]
+        assert stor._get_log_sync("t1", origin="a/a")[1] == entries
+        assert stor._search_sync("hello") == [(1, "t1", "a/a", "hello world")]
+
+        # running tasks of earlier versions have no lease and are reclaimed
+        tid,task = stor.start_next_task()
+        assert tid == "t2" and task.names == ["b"]
+
+        # log ids keep counting past the migrated ones
+        stor.add_log("t2", {"type": "log", "msg": "more"})
+        stor._log_writer.flush()
+        rowids = [ rowid for rowid,_ in stor._get_log_sync("t2")[1] ]
+        assert rowids[0] == 5 and rowids[1] > 5
+
+    # opening an up to date database changes nothing
+    with Storage(path, worker_id="w1"):
+        assert user_version(path) == Storage.VERSION
+
+def test_migrate_archived_logs(path):
+    class OldStorage(Storage):
+        VERSION = 5
+
+    with OldStorage(path) as stor:
+        stor._sql("INSERT INTO tasks (tid,data,status) VALUES ('t1','',3)")
+        stor._sql("""
+            INSERT INTO log (tid,data)
+            VALUES ('t1','{"type":"log","msg":"archived line"}')
+        """)
+        stor._sql("INSERT INTO log (tid,data) VALUES ('t1',NULL)")
+        stor._archive_task(stor._conn, "t1")
+
+    with Storage(path) as stor:
+        assert stor._search_sync("archived") == [
+            (1, "t1", None, "archived line"),
+        ]
+        stor._sql("INSERT INTO tasks (tid,data) VALUES ('t2','')")
+        stor._sql("INSERT INTO log (tid,data) VALUES ('t2','{}')")
+        assert stor._read(
+            "SELECT MAX(rowid) FROM log", results=1
+        ) == (3,)
+
+def test_log_ids_not_reused_after_archiving(stor, path):
+    stor.enqueue("t1", Task("a"))
+    stor.start_next_task()
+    stor.add_log("t1", {"type": "log", "msg": "one"})
+    stor.end_task("t1")
+    _,entries = stor._get_log_sync("t1")
+
+    conn = sqlite3.connect(path, isolation_level=None)
+    stor.maintain(conn, archive_after=-1)
+    conn.close()
+    assert stor._get_log_sync("t1") == (True, entries)
+
+    stor.enqueue("t2", Task("b"))
+    stor.add_log("t2", {"type": "log", "msg": "two"})
+    stor._log_writer.flush()
+    (rowid,_), = stor._get_log_sync("t2")[1]
+    assert rowid > entries[-1][0]
+
+def test_purge(stor, path):
+    for tid in ("t1", "t2", "t3"):
+        stor.enqueue(tid, Task(tid))
+        stor.start_next_task()
+        stor.add_log(tid, {"type": "log", "msg": f"log of {tid}"})
+        stor.end_task(tid)
+    stor._sql("UPDATE tasks SET finished=0 WHERE tid='t1'")
+
+    conn = sqlite3.connect(path, isolation_level=None)
+    stor.maintain(conn, archive_after=-1, max_age=3600)
+    assert stor._get_log_sync("t1") == (True, [])
+    assert len(stor._get_log_sync("t2")[1]) == 1
+
+    # the oldest tasks go first until the archive fits
+    stor.maintain(conn, max_size=1)
+    conn.close()
+    assert stor._read(
+        "SELECT COUNT(*) FROM log_archive", results=1
+    ) == (0,)
+    assert stor._search_sync("log") == []
+
+def test_claim_in_order(stor):
+    assert stor.start_next_task() is None
+    stor.enqueue("t1", Task("a"))
+    stor.enqueue("t2", Task("b"))
+
+    tid,task = stor.start_next_task()
+    assert tid == "t1" and task.names == ["a"]
+    assert stor.start_next_task()[0] == "t2"
+    assert stor.start_next_task() is None
+    assert stor._read(
+        "SELECT status,worker FROM tasks WHERE tid='t1'", results=1
+    ) == (2, "w1")
+
+def test_claim_selector(stor):
+    stor.enqueue("t1", Task("a"))
+    stor.enqueue("t2", Task("b"))
+    stor.start_next_task()
+
+    seen = []
+    def select(pending, running):
+        seen.append(([ tid for tid,_ in pending ],
+                     [ tid for tid,_ in running ]))
+        return None
+
+    assert stor.claim_next(select) is None
+    assert seen == [(["t2"], ["t1"])]
+    assert stor._read(
+        "SELECT status FROM tasks WHERE tid='t2'", results=1
+    ) == (1,)
+
+def test_coalesced_tasks_are_not_claimed(stor):
+    assert stor.enqueue("t1", Task("a", "g"), coalesce=True) == "t1"
+    assert stor.enqueue("t2", Task("b", "g"), coalesce=True) == "t1"
+
+    tid,task = stor.start_next_task()
+    assert tid == "t1" and task.names == ["a", "b"]
+    assert stor.start_next_task() is None
+
+    stor.end_task("t1", "done")
+    assert stor.get_result("t2") == (3, "done")
+
+def test_expired_lease_is_reclaimed(stor, path):
+    stor.enqueue("t1", Task("a"))
+    stor.start_next_task()
+
+    with Storage(path, worker_id="w2") as other:
+        assert other.start_next_task() is None
+        stor._sql("UPDATE tasks SET lease=0 WHERE tid='t1'")
+        assert other.start_next_task()[0] == "t1"
+
+        # the first worker lost its lease and must not end the task
+        stor.end_task("t1", "stale")
+        assert other.get_result("t1") == (2, None)
+        other.end_task("t1", "fresh")
+        assert stor.get_result("t1") == (3, "fresh")
+
+def test_renew_leases(stor):
+    stor.enqueue("t1", Task("a"))
+    stor.enqueue("t2", Task("b"))
+    stor.start_next_task()
+    stor.start_next_task()
+    stor._sql("UPDATE tasks SET lease=0")
+
+    stor.renew_leases([])
+    stor.renew_leases(["t2"])
+    assert stor._read(
+        "SELECT tid FROM tasks WHERE lease>0", results=True
+    ) == [("t2",)]
+
+def test_end_task_needs_claim(stor):
+    stor.enqueue("t1", Task("a"))
+    stor.end_task("t1", "done")
+    assert stor.get_result("t1") == (1, None)
+
+def test_release_task(stor):
+    stor.enqueue("t1", Task("a"))
+    stor.start_next_task()
+    stor.release_task("t1")
+    assert stor._read(
+        "SELECT status,worker,lease FROM tasks WHERE tid='t1'", results=1
+    ) == (1, None, None)
+    assert stor.start_next_task()[0] == "t1"
+
+def test_build_time_percentiles(stor):
+    for duration in (10, 20, 30, 40):
+        stor.add_build_time("t1", "j1", "p1", "a/a", duration, "success", "a")
+    stor.add_build_time("t1", "j1", "p1", "a/a", 1000, "failed", "a")
+    stor.add_build_time("t1", "j2", "p1", "a/a", 500, "success", "a")
+    stor.add_build_time("t1", "j2", "p1", "b/b", 60, "success", "b")
+
+    stats = stor.build_time_percentiles(jail="j1", ports_branch="p1")
+    # other jails only count for ports never built on the requested one
+    assert stats == {
+        "a/a": { "pkgbase": "a", "builds": 4, "p50": 25, "p90": 37 },
+        "b/b": { "pkgbase": "b", "builds": 1, "p50": 60, "p90": 60 },
+    }
+    assert stor.build_time_percentiles(
+        origins=["b/b"], jail="j1", ports_branch="p1", percentiles=(50,)
+    ) == { "b/b": { "pkgbase": "b", "builds": 1, "p50": 60 } }
+    assert stor.build_time_percentiles(
+        jail="j1", ports_branch="p1", history=2
+    )["a/a"]["builds"] == 2
+
+def test_maintain_prunes_build_times(stor, path):
+    for jail in ("j1", "j2"):
+        for finished in range(5):
+            stor._sql("""
+                INSERT INTO build_times
+                  (origin,jail,ports_branch,duration,result,finished)
+                VALUES ('a/a',?,'p1',?,'success',?)
+            """, jail, finished, finished)
+
+    conn = sqlite3.connect(path, isolation_level=None)
+    stor.maintain(conn, build_history=2)
+    conn.close()
+    assert stor._read("""
+        SELECT jail,COUNT(*),MIN(duration) FROM build_times
+        GROUP BY jail ORDER BY jail
+    """, results=True) == [("j1", 2, 3), ("j2", 2, 3)]